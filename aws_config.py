@@ -31,6 +31,10 @@ AWS_IOT_PORT = 8883
 # Topic to publish to
 AWS_IOT_TOPIC = "beaconscanner"
 
+# Payload compression, compressed payloads are published on AWS_IOT_TOPIC/deflate
+AWS_IOT_COMPRESSION_ENABLED = True
+AWS_IOT_COMPRESS_MIN_SIZE = 256 # bytes, smaller payloads are sent as plain json
+
 # Certificate
 AWS_IOT_CLIENT_CERT = "/flash/cert/certificate.pem.crt"
 
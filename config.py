@@ -22,9 +22,16 @@
 InnovateNow Outdoor Tracker configuration settings
 """
 
+import binascii
+import machine
+
 from network import LoRa
 import inlogging as logging
 
+# Device identification
+DEVICE_ID = binascii.hexlify(machine.unique_id()).decode('UTF-8')
+CUSTOMER = "InnovateNow"
+
 # Log level
 LOG_LEVEL = logging.DEBUG
 
@@ -43,13 +50,43 @@ DEEPSLEEP_ENABLED = True
 DEEPSLEEP_AWAKE_ON_ACCELEROMETER = True
 DEEPSLEEP_IN_SECONDS = 300
 
+# Motion adaptive sleep: report every SCHEDULE_MOVING_SECONDS while moving,
+# while stationary double DEEPSLEEP_IN_SECONDS every wake up to the heartbeat
+SCHEDULE_ENABLED = False
+SCHEDULE_MOVING_SECONDS = 60
+SCHEDULE_MOVING_SPEED_KPH = 5 # GPS speed to consider the asset moving
+SCHEDULE_MOVING_ACTIVITY = 20 # Motion activity percentage to consider the asset moving
+SCHEDULE_HEARTBEAT_SECONDS = 21600 # Max sleep while stationary (6 hours)
+SCHEDULE_BUDGET_MAH_PER_DAY = 50 # Battery budget, wakes are limited when spent
+SCHEDULE_WAKE_MAH = 0.3 # Estimated charge of one wake cycle
+
+# The Pytrack sleep timer calibration is stored and only repeated when stale
+RTC_CALIBRATION_MAX_AGE = 86400 # Seconds
+RTC_CALIBRATION_MAX_TEMP_DELTA = 5 # Celsius
+
+# Battery (LiPo) for the state of charge and energy budget
+# Below BATTERY_SOC_HIGH sampling, GPS time and uplinks are scaled down, at BATTERY_SOC_LOW to the minimum
+BATTERY_CAPACITY_MAH = 2000
+BATTERY_AWAKE_MA = 60 # Average current while awake
+BATTERY_SLEEP_UA = 20 # Average current during deepsleep
+BATTERY_SOC_LOW = 10 # Percentage
+BATTERY_SOC_HIGH = 40 # Percentage
+
 # Accelerometer wakeup settings
 ACCELEROMETER_THRESHOLD = 2000 # mG means 2G
 ACCLEROMETER_DURATION_MS = 200 # in ms
 
+# Motion analytics (activity, shocks, vibration, tilt) from the accelerometer FIFO while awake
+MOTION_ANALYTICS_ENABLED = False
+MOTION_ODR = 3 # LIS2HH12 output data rate: 2 = 50Hz, 3 = 100Hz, 4 = 200Hz, 5 = 400Hz
+MOTION_ACTIVITY_MG = 100 # Deviation from 1G counted as activity
+MOTION_SHOCK_MG = 2500 # Shock event threshold
+MOTION_TILT_DEGREES = 30 # Orientation change reported as tamper
+
 # LoRa settings
 LORA_ENABLED = True
 LORA_ACTIVATION = LoRa.OTAA
+LORA_BINARY_FRAME = False # Binary integer frame instead of the text frame
 
 # LoRa OTAA
 LORA_APP_EUI = '70 B3 D5 7E D0 00 B7 C1'
@@ -65,12 +102,59 @@ WLAN_ENABLED = False
 WLAN_SSID = "HARTOG_GUEST" # SSID to connect to
 WLAN_KEY = "1234567890"    # SSID key
 WLAN_INT_ANTENNA = True    # True internal antenna else False
+WLAN_TIMEOUT = 10          # Max seconds to wait for a connection
+WLAN_REUSE_IP = False      # Reuse the cached DHCP lease on reconnect (skips DHCP)
+WLAN_LEASE_AGE = 3600      # Max seconds to reuse the cached DHCP lease
+
+# BLE positioning when GPS has no fix
+# Only beacons with registered UUIDs (iBeacon UUID or Eddystone namespace) are reported,
+# the position in the list is the UUID index in the LoRa frame, no scan without UUIDs
+BLE_POSITIONING_ENABLED = True
+BLE_POSITIONING_SCAN_SECONDS = 10 # Max scan time, never longer than the GPS attempt
+BLE_POSITIONING_MAX_BEACONS = 4   # Strongest beacons to report
+BLE_UUIDS = []
+
+# Beacon and tag presence in the json message as enter/exit deltas with a periodic full keyframe
+BLE_PRESENCE_ENABLED = True
+BLE_PRESENCE_FILE = "/flash/presence.bin"
+BLE_PRESENCE_SCAN_SECONDS = 5 # Presence scan on every wake, independent of the GPS fix
+BLE_PRESENCE_CAPACITY = 100   # Max beacons and tags (each) in the presence set
+BLE_PRESENCE_KEYFRAME = 12 # Reports between full keyframes
+
+# Fleet filter file (tools/fleet_filter.py), advertisements of other MACs are ignored
+BLE_FLEET_FILTER = None # e.g. "/flash/fleet.bin"
+
+# Backlog of messages that could not be sent, drained via WLAN/MQTT (only kept when WLAN is enabled)
+BACKLOG_FILE = "/flash/backlog.json"
+BACKLOG_MAX_ITEMS = 100
 
 # Environmental sensor is the BME280 sensor (temp, humidity and barometric pressure)
 ENVIRONMENT_SENSOR_AVAILABLE = True
+# Sampling preset: 'weather' (forced, 1x, filter off; lowest current for slow changes),
+# 'humidity', 'indoor' or 'gaming' (normal mode, continuous sampling)
+ENVIRONMENT_SENSOR_PRESET = 'weather'
+# Statistics window (min/max/mean/stdev) of the samples taken while awake, every uplink
+# reports the window so far, threshold time is only counted while sampling (not across deepsleep)
+ENVIRONMENT_STATS_ENABLED = True
+ENVIRONMENT_STATS_FILE = "/flash/envstats.bin"
+ENVIRONMENT_STATS_WINDOW = 3600 # Seconds of the reporting window
+ENVIRONMENT_SAMPLE_INTERVAL = 5 # Seconds between samples while awake
+ENVIRONMENT_TEMPERATURE_HIGH = None # Celsius, e.g. 8 for cold chain
+ENVIRONMENT_TEMPERATURE_LOW = None # Celsius, e.g. 2 for cold chain
+# Temperature time series on flash, drained over WLAN/MQTT
+ENVIRONMENT_SERIES_ENABLED = False
+ENVIRONMENT_SERIES_FILE = "/flash/series.bin"
+ENVIRONMENT_SERIES_BLOCKS = 32 # Blocks of 256 bytes, 32 blocks hold about 2.5 days of 1 minute samples
+ENVIRONMENT_SERIES_INTERVAL = 60 # Seconds between samples
+# Store raw BME280 samples (one I2C burst) and compensate them in batch before the uplink
+ENVIRONMENT_DEFERRED_COMPENSATION = False
+ENVIRONMENT_RAW_FILE = "/flash/envraw.bin"
 
 # NTP for setting the correct time
+# Time is set from GPS, NTP is only a fallback when WLAN is connected and GPS has no time
 NTP_POOL_SERVER = "nl.pool.ntp.org"
+NTP_FALLBACK_ENABLED = True
+NTP_SYNC_TIMEOUT = 10 # Max seconds to wait for NTP
 
 # LED color configuration
 LED_COLOR_ERROR = 0xff0000      # Red
@@ -1,6 +1,6 @@
 import math
 import time
-import struct
+from array import array
 from machine import Pin
 
 
@@ -16,6 +16,13 @@ ODR_200_HZ = const(4)
 ODR_400_HZ = const(5)
 ODR_800_HZ = const(6)
 
+FIFO_MODE_BYPASS = const(0)
+FIFO_MODE_FIFO = const(1)
+FIFO_MODE_STREAM = const(2)
+FIFO_MODE_STREAM_TO_FIFO = const(3)
+
+FIFO_SIZE = const(32)
+
 ACC_G_DIV = 1000 * 65536
 
 
@@ -37,6 +44,8 @@ class LIS2HH12:
     ACC_Z_H_REG = const(0x2D)
     ACT_THS = const(0x1E)
     ACT_DUR = const(0x1F)
+    FIFO_CTRL_REG = const(0x2E)
+    FIFO_SRC_REG = const(0x2F)
 
     SCALES = {FULL_SCALE_2G: 4000, FULL_SCALE_4G: 8000, FULL_SCALE_8G: 16000}
     ODRS = [0, 10, 50, 100, 200, 400, 800]
@@ -56,6 +65,9 @@ class LIS2HH12:
         self.int_pin = None
         self.act_dur = 0
         self.debounced = False
+        self._mult = 0
+        self._xyz = array('h', [0, 0, 0])
+        self._fifo = None
 
         whoami = self.i2c.readfrom_mem(ACC_I2CADDR , PRODUCTID_REG, 1)
         if (whoami[0] != 0x41):
@@ -70,29 +82,66 @@ class LIS2HH12:
         # set the interrupt pin as active low and open drain
         self.set_register(CTRL5_REG, 3, 0, 3)
 
+        # block data update and register address auto increment for burst reads
+        self.set_register(CTRL1_REG, 1, 3, 1)
+        self.set_register(CTRL4_REG, 1, 2, 1)
+
         # make a first read
         self.acceleration()
 
+    def acceleration_raw(self, into=None):
+        # one 6 byte burst (x, y, z) into an array('h') of 3, no allocation
+        if into is None:
+            into = self._xyz
+        self.i2c.readfrom_mem_into(ACC_I2CADDR , ACC_X_L_REG, into)
+        return into
+
     def acceleration(self):
-        x = self.i2c.readfrom_mem(ACC_I2CADDR , ACC_X_L_REG, 2)
-        self.x = struct.unpack('<h', x)
-        y = self.i2c.readfrom_mem(ACC_I2CADDR , ACC_Y_L_REG, 2)
-        self.y = struct.unpack('<h', y)
-        z = self.i2c.readfrom_mem(ACC_I2CADDR , ACC_Z_L_REG, 2)
-        self.z = struct.unpack('<h', z)
-        _mult = self.SCALES[self.full_scale] / ACC_G_DIV
-        return (self.x[0] * _mult, self.y[0] * _mult, self.z[0] * _mult)
-
-    def roll(self):
-        x,y,z = self.acceleration()
+        xyz = self.acceleration_raw()
+        self.x = xyz[0]
+        self.y = xyz[1]
+        self.z = xyz[2]
+        _mult = self._mult
+        return (self.x * _mult, self.y * _mult, self.z * _mult)
+
+    def roll(self, acc=None):
+        # acc is an acceleration() result, read when not given
+        x,y,z = acc or self.acceleration()
         rad = math.atan2(-x, z)
         return (180 / math.pi) * rad
 
-    def pitch(self):
-        x,y,z = self.acceleration()
+    def pitch(self, acc=None):
+        # acc is an acceleration() result, read when not given
+        x,y,z = acc or self.acceleration()
         rad = -math.atan2(y, (math.sqrt(x*x + z*z)))
         return (180 / math.pi) * rad
 
+    def enable_fifo(self, mode=FIFO_MODE_STREAM, threshold=FIFO_SIZE - 1):
+        # samples are collected by the chip at the odr, 32 samples deep
+        self.i2c.writeto_mem(ACC_I2CADDR, FIFO_CTRL_REG, bytes([(mode << 5) | (threshold & 0x1F)]))
+        self.set_register(CTRL3_REG, 1 if mode != FIFO_MODE_BYPASS else 0, 7, 1)
+        if self._fifo is None:
+            self._fifo = array('h', [0] * (3 * FIFO_SIZE))
+
+    def disable_fifo(self):
+        self.enable_fifo(FIFO_MODE_BYPASS, 0)
+
+    def fifo_count(self):
+        src = self.i2c.readfrom_mem(ACC_I2CADDR, FIFO_SRC_REG, 1)[0]
+        if src & 0x40: # overrun, fifo full
+            return FIFO_SIZE
+        return src & 0x1F
+
+    def read_fifo(self, into=None):
+        # burst read all stored samples as x, y, z triplets into an array('h')
+        # returns the number of samples read
+        if into is None:
+            into = self._fifo
+        count = min(self.fifo_count(), len(into) // 3)
+        if count:
+            self.i2c.readfrom_mem_into(ACC_I2CADDR, ACC_X_L_REG, memoryview(into)[:3 * count])
+        return count
+
     def set_register(self, register, value, offset, mask):
         reg = bytearray(self.i2c.readfrom_mem(ACC_I2CADDR, register, 1))
         reg[0] &= ~(mask << offset)
@@ -102,6 +151,7 @@ class LIS2HH12:
     def set_full_scale(self, scale):
         self.set_register(CTRL4_REG, scale, 4, 3)
         self.full_scale = scale
+        self._mult = self.SCALES[scale] / ACC_G_DIV
 
     def set_odr(self, odr):
         self.set_register(CTRL1_REG, odr, 4, 7)
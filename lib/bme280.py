@@ -40,16 +40,147 @@ BME280_OSAMPLE_4 = 3
 BME280_OSAMPLE_8 = 4
 BME280_OSAMPLE_16 = 5
 
+BME280_OSAMPLE_SKIP = 0 # Channel not measured
+
+# IIR filter coefficient
+BME280_IIR_OFF = 0
+BME280_IIR_2 = 1
+BME280_IIR_4 = 2
+BME280_IIR_8 = 3
+BME280_IIR_16 = 4
+
+# Standby time between normal mode measurements
+BME280_STANDBY_0_5 = 0  # 0.5 ms
+BME280_STANDBY_62_5 = 1 # 62.5 ms
+BME280_STANDBY_125 = 2
+BME280_STANDBY_250 = 3
+BME280_STANDBY_500 = 4
+BME280_STANDBY_1000 = 5
+BME280_STANDBY_10 = 6
+BME280_STANDBY_20 = 7
+
+# Sensor modes
+BME280_MODE_SLEEP = 0
+BME280_MODE_FORCED = 1
+BME280_MODE_NORMAL = 3
+
+# Recommended settings from the datasheet:
+# (sensor mode, temperature, pressure, humidity oversampling, IIR filter, standby)
+BME280_PRESETS = {
+    'weather': (BME280_MODE_FORCED, BME280_OSAMPLE_1, BME280_OSAMPLE_1, BME280_OSAMPLE_1,
+                BME280_IIR_OFF, BME280_STANDBY_1000),
+    'humidity': (BME280_MODE_FORCED, BME280_OSAMPLE_1, BME280_OSAMPLE_SKIP, BME280_OSAMPLE_1,
+                 BME280_IIR_OFF, BME280_STANDBY_1000),
+    'indoor': (BME280_MODE_NORMAL, BME280_OSAMPLE_2, BME280_OSAMPLE_16, BME280_OSAMPLE_1,
+               BME280_IIR_16, BME280_STANDBY_0_5),
+    'gaming': (BME280_MODE_NORMAL, BME280_OSAMPLE_1, BME280_OSAMPLE_4, BME280_OSAMPLE_SKIP,
+               BME280_IIR_16, BME280_STANDBY_0_5),
+}
+
 BME280_REGISTER_CONTROL_HUM = 0xF2
 BME280_REGISTER_CONTROL = 0xF4
+BME280_REGISTER_CONFIG = 0xF5
+
+# Calibration data: 26 bytes from 0x88 and 7 bytes from 0xE1
+BME280_CALIBRATION_SIZE = 33
+
+
+def calibration(data):
+    """ Return the compensation coefficients (T1-T3, P1-P9, H1-H6) from the calibration data """
+    dig_T1, dig_T2, dig_T3, dig_P1, dig_P2, dig_P3, dig_P4, dig_P5, \
+        dig_P6, dig_P7, dig_P8, dig_P9, _, dig_H1 = unpack("<HhhHhhhhhhhhBB", data[:26])
+
+    dig_H2, dig_H3 = unpack_from("<hB", data, 26)
+    e4_sign = unpack_from("<b", data, 29)[0]
+    dig_H4 = (e4_sign << 4) | (data[30] & 0xF)
+
+    e6_sign = unpack_from("<b", data, 31)[0]
+    dig_H5 = (e6_sign << 4) | (data[30] >> 4)
+
+    dig_H6 = unpack_from("<b", data, 32)[0]
+
+    return (dig_T1, dig_T2, dig_T3, dig_P1, dig_P2, dig_P3, dig_P4, dig_P5, dig_P6,
+            dig_P7, dig_P8, dig_P9, dig_H1, dig_H2, dig_H3, dig_H4, dig_H5, dig_H6)
+
+def parse_burst(readout, result):
+    """ Store the raw temperature, pressure, humidity of the 8 bytes burst (0xF7-0xFE) in result """
+    # pressure(0xF7): ((msb << 16) | (lsb << 8) | xlsb) >> 4
+    result[1] = ((readout[0] << 16) | (readout[1] << 8) | readout[2]) >> 4
+    # temperature(0xFA): ((msb << 16) | (lsb << 8) | xlsb) >> 4
+    result[0] = ((readout[3] << 16) | (readout[4] << 8) | readout[5]) >> 4
+    # humidity(0xFD): (msb << 8) | lsb
+    result[2] = (readout[6] << 8) | readout[7]
+
+def compensate(cal, raw_temp, raw_press, raw_hum, result):
+    """
+    Compensate the raw values with the coefficients of calibration()
+    Stores temperature (centi celsius), pressure (Q24.8 Pa), humidity
+    (1/1024 percentage) in result, returns t_fine
+    """
+    dig_T1, dig_T2, dig_T3, dig_P1, dig_P2, dig_P3, dig_P4, dig_P5, dig_P6, \
+        dig_P7, dig_P8, dig_P9, dig_H1, dig_H2, dig_H3, dig_H4, dig_H5, dig_H6 = cal
+
+    # temperature
+    var1 = ((raw_temp >> 3) - (dig_T1 << 1)) * (dig_T2 >> 11)
+    var2 = (((((raw_temp >> 4) - dig_T1) *
+              ((raw_temp >> 4) - dig_T1)) >> 12) * dig_T3) >> 14
+    t_fine = var1 + var2
+    temp = (t_fine * 5 + 128) >> 8
+
+    # pressure
+    var1 = t_fine - 128000
+    var2 = var1 * var1 * dig_P6
+    var2 = var2 + ((var1 * dig_P5) << 17)
+    var2 = var2 + (dig_P4 << 35)
+    var1 = (((var1 * var1 * dig_P3) >> 8) +
+            ((var1 * dig_P2) << 12))
+    var1 = (((1 << 47) + var1) * dig_P1) >> 33
+    if var1 == 0:
+        pressure = 0
+    else:
+        p = 1048576 - raw_press
+        p = (((p << 31) - var2) * 3125) // var1
+        var1 = (dig_P9 * (p >> 13) * (p >> 13)) >> 25
+        var2 = (dig_P8 * p) >> 19
+        pressure = ((p + var1 + var2) >> 8) + (dig_P7 << 4)
+
+    # humidity
+    h = t_fine - 76800
+    h = (((((raw_hum << 14) - (dig_H4 << 20) -
+            (dig_H5 * h)) + 16384)
+          >> 15) * (((((((h * dig_H6) >> 10) *
+                        (((h * dig_H3) >> 11) + 32768)) >> 10) +
+                      2097152) * dig_H2 + 8192) >> 14))
+    h = h - (((((h >> 15) * (h >> 15)) >> 7) * dig_H1) >> 4)
+    h = 0 if h < 0 else h
+    h = 419430400 if h > 419430400 else h
+
+    result[0] = temp
+    result[1] = pressure
+    result[2] = h >> 12
+    return t_fine
 
 class BME280(object):
-    """ BME280 sensor for temperature, humidiy, barometeric pressure """
+    """
+    BME280 sensor for temperature, humidiy, barometeric pressure
+    mode is the oversampling of all channels unless set per channel with
+    osrs_t, osrs_p and osrs_h. In forced sensor mode every read triggers a
+    measurement and waits for it; in normal sensor mode the sensor measures
+    continuously (every standby period) and a read is a single burst read.
+    A preset name from BME280_PRESETS sets all of these at once.
+    """
 
     def __init__(self,
                  mode=BME280_OSAMPLE_1,
                  address=BME280_I2CADDR1,
                  i2c=None,
+                 osrs_t=None,
+                 osrs_p=None,
+                 osrs_h=None,
+                 iir=BME280_IIR_OFF,
+                 standby=BME280_STANDBY_1000,
+                 sensor_mode=BME280_MODE_FORCED,
+                 preset=None,
                  **kwargs):
         # Check that mode is valid.
         if mode not in [BME280_OSAMPLE_1, BME280_OSAMPLE_2, BME280_OSAMPLE_4,
@@ -64,25 +195,14 @@ class BME280(object):
             raise ValueError('An I2C object is required.')
         self.i2c = i2c
 
-        # load calibration data
-        dig_88_a1 = self.i2c.readfrom_mem(self.address, 0x88, 26)
-        dig_e1_e7 = self.i2c.readfrom_mem(self.address, 0xE1, 7)
-        self.dig_T1, self.dig_T2, self.dig_T3, self.dig_P1, \
-            self.dig_P2, self.dig_P3, self.dig_P4, self.dig_P5, \
-            self.dig_P6, self.dig_P7, self.dig_P8, self.dig_P9, \
-            _, self.dig_H1 = unpack("<HhhHhhhhhhhhBB", dig_88_a1)
-
-        self.dig_H2, self.dig_H3 = unpack("<hB", dig_e1_e7)
-        e4_sign = unpack_from("<b", dig_e1_e7, 3)[0]
-        self.dig_H4 = (e4_sign << 4) | (dig_e1_e7[4] & 0xF)
-
-        e6_sign = unpack_from("<b", dig_e1_e7, 5)[0]
-        self.dig_H5 = (e6_sign << 4) | (dig_e1_e7[4] >> 4)
+        # load calibration data, kept raw for deferred compensation
+        self.calibration_data = bytes(self.i2c.readfrom_mem(self.address, 0x88, 26)) + \
+                                bytes(self.i2c.readfrom_mem(self.address, 0xE1, 7))
+        self._cal = calibration(self.calibration_data)
+        self.dig_T1, self.dig_T2, self.dig_T3, self.dig_P1, self.dig_P2, self.dig_P3, \
+            self.dig_P4, self.dig_P5, self.dig_P6, self.dig_P7, self.dig_P8, self.dig_P9, \
+            self.dig_H1, self.dig_H2, self.dig_H3, self.dig_H4, self.dig_H5, self.dig_H6 = self._cal
 
-        self.dig_H6 = unpack_from("<b", dig_e1_e7, 6)[0]
-
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL,
-                             bytearray([0x3F]))
         self.t_fine = 0
 
         # temporary data holders which stay allocated
@@ -90,6 +210,67 @@ class BME280(object):
         self._l8_barray = bytearray(8)
         self._l3_resultarray = array("i", [0, 0, 0])
 
+        if preset is not None:
+            sensor_mode, osrs_t, osrs_p, osrs_h, iir, standby = BME280_PRESETS[preset]
+
+        self.configure(osrs_t=mode if osrs_t is None else osrs_t,
+                       osrs_p=mode if osrs_p is None else osrs_p,
+                       osrs_h=mode if osrs_h is None else osrs_h,
+                       iir=iir, standby=standby, sensor_mode=sensor_mode)
+
+    def configure(self, osrs_t=BME280_OSAMPLE_1, osrs_p=BME280_OSAMPLE_1,
+                  osrs_h=BME280_OSAMPLE_1, iir=BME280_IIR_OFF,
+                  standby=BME280_STANDBY_1000, sensor_mode=BME280_MODE_FORCED):
+        """ Set the oversampling per channel, IIR filter, standby time and sensor mode """
+        self._osrs_t = osrs_t
+        self._osrs_p = osrs_p
+        self._osrs_h = osrs_h
+        self._sensor_mode = sensor_mode
+
+        # Max measurement time in us (datasheet appendix B)
+        self._measure_time = 1250 + 2300 * self.__osr(osrs_t)
+        if osrs_p:
+            self._measure_time += 2300 * self.__osr(osrs_p) + 575
+        if osrs_h:
+            self._measure_time += 2300 * self.__osr(osrs_h) + 575
+
+        # Config is only written reliably in sleep mode
+        self._l1_barray[0] = osrs_t << 5 | osrs_p << 2 | BME280_MODE_SLEEP
+        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL, self._l1_barray)
+        self._l1_barray[0] = standby << 5 | iir << 2
+        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONFIG, self._l1_barray)
+
+        # Humidity oversampling is applied after the next control write
+        self._l1_barray[0] = osrs_h
+        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL_HUM, self._l1_barray)
+
+        if sensor_mode == BME280_MODE_NORMAL:
+            self._l1_barray[0] = osrs_t << 5 | osrs_p << 2 | BME280_MODE_NORMAL
+            self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL, self._l1_barray)
+            time.sleep_us(self._measure_time) # First measurement available
+
+    @staticmethod
+    def __osr(osrs):
+        """ Oversampling register value to number of samples """
+        return (1 << (osrs - 1)) if osrs else 0
+
+    def read_burst(self):
+        """ Measure (forced mode) and burst read the 8 raw data bytes (0xF7-0xFE).
+            Returns:
+                bytearray that is reused by the next read
+        """
+
+        # In normal mode the sensor measures continuously, only read
+        if self._sensor_mode != BME280_MODE_NORMAL:
+            self._l1_barray[0] = self._osrs_t << 5 | self._osrs_p << 2 | BME280_MODE_FORCED
+            self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL,
+                                 self._l1_barray)
+            time.sleep_us(self._measure_time)  # Wait the required time
+
+        # burst readout from 0xF7 to 0xFE, recommended by datasheet
+        self.i2c.readfrom_mem_into(self.address, 0xF7, self._l8_barray)
+        return self._l8_barray
+
     def read_raw_data(self, result):
         """ Reads the raw (uncompensated) data from the sensor.
             Args:
@@ -98,32 +279,7 @@ class BME280(object):
             Returns:
                 None
         """
-
-        self._l1_barray[0] = self._mode
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL_HUM,
-                             self._l1_barray)
-        self._l1_barray[0] = self._mode << 5 | self._mode << 2 | 1
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL,
-                             self._l1_barray)
-
-        sleep_time = 1250 + 2300 * (1 << self._mode)
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        time.sleep_us(sleep_time)  # Wait the required time
-
-        # burst readout from 0xF7 to 0xFE, recommended by datasheet
-        self.i2c.readfrom_mem_into(self.address, 0xF7, self._l8_barray)
-        readout = self._l8_barray
-        # pressure(0xF7): ((msb << 16) | (lsb << 8) | xlsb) >> 4
-        raw_press = ((readout[0] << 16) | (readout[1] << 8) | readout[2]) >> 4
-        # temperature(0xFA): ((msb << 16) | (lsb << 8) | xlsb) >> 4
-        raw_temp = ((readout[3] << 16) | (readout[4] << 8) | readout[5]) >> 4
-        # humidity(0xFD): (msb << 8) | lsb
-        raw_hum = (readout[6] << 8) | readout[7]
-
-        result[0] = raw_temp
-        result[1] = raw_press
-        result[2] = raw_hum
+        parse_burst(self.read_burst(), result)
 
     def read_compensated_data(self, result=None):
         """ Reads the data from the sensor and returns the compensated data.
@@ -137,49 +293,12 @@ class BME280(object):
         """
         self.read_raw_data(self._l3_resultarray)
         raw_temp, raw_press, raw_hum = self._l3_resultarray
-        # temperature
-        var1 = ((raw_temp >> 3) - (self.dig_T1 << 1)) * (self.dig_T2 >> 11)
-        var2 = (((((raw_temp >> 4) - self.dig_T1) *
-                  ((raw_temp >> 4) - self.dig_T1)) >> 12) * self.dig_T3) >> 14
-        self.t_fine = var1 + var2
-        temp = (self.t_fine * 5 + 128) >> 8
-
-        # pressure
-        var1 = self.t_fine - 128000
-        var2 = var1 * var1 * self.dig_P6
-        var2 = var2 + ((var1 * self.dig_P5) << 17)
-        var2 = var2 + (self.dig_P4 << 35)
-        var1 = (((var1 * var1 * self.dig_P3) >> 8) +
-                ((var1 * self.dig_P2) << 12))
-        var1 = (((1 << 47) + var1) * self.dig_P1) >> 33
-        if var1 == 0:
-            pressure = 0
-        else:
-            p = 1048576 - raw_press
-            p = (((p << 31) - var2) * 3125) // var1
-            var1 = (self.dig_P9 * (p >> 13) * (p >> 13)) >> 25
-            var2 = (self.dig_P8 * p) >> 19
-            pressure = ((p + var1 + var2) >> 8) + (self.dig_P7 << 4)
-
-        # humidity
-        h = self.t_fine - 76800
-        h = (((((raw_hum << 14) - (self.dig_H4 << 20) -
-                (self.dig_H5 * h)) + 16384)
-              >> 15) * (((((((h * self.dig_H6) >> 10) *
-                            (((h * self.dig_H3) >> 11) + 32768)) >> 10) +
-                          2097152) * self.dig_H2 + 8192) >> 14))
-        h = h - (((((h >> 15) * (h >> 15)) >> 7) * self.dig_H1) >> 4)
-        h = 0 if h < 0 else h
-        h = 419430400 if h > 419430400 else h
-        humidity = h >> 12
-
-        if result:
-            result[0] = temp
-            result[1] = pressure
-            result[2] = humidity
-            return result
-
-        return array("i", (temp, pressure, humidity))
+
+        if not result:
+            result = array("i", (0, 0, 0))
+
+        self.t_fine = compensate(self._cal, raw_temp, raw_press, raw_hum, result)
+        return result
 
     @property
     def temperature(self):
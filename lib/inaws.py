@@ -27,6 +27,7 @@ import sys
 import socket
 
 import aws_config as config
+import incompress
 from MQTTLib import AWSIoTMQTTClient
 
 # Initialize logging
@@ -72,10 +73,23 @@ class AWS(object):
 
     def publish(self, msg=None):
         """
-        Publish message
+        Publish message, returns True when published
+        Payloads of at least AWS_IOT_COMPRESS_MIN_SIZE bytes are deflated and
+        published on the topic with the content encoding suffix
         """
-        log.info('Publish [{}]', json.dumps(msg))
-        self.client.publish(config.AWS_IOT_TOPIC, json.dumps(msg), 1)
+        payload = json.dumps(msg)
+        topic = config.AWS_IOT_TOPIC
+        log.info('Publish [{}]', payload)
+
+        if config.AWS_IOT_COMPRESSION_ENABLED and \
+           len(payload) >= config.AWS_IOT_COMPRESS_MIN_SIZE:
+            compressed = incompress.compress(payload)
+            if compressed and len(compressed) < len(payload):
+                log.debug('Compressed payload {} -> {} bytes', len(payload), len(compressed))
+                payload = compressed
+                topic = topic + '/' + incompress.ENCODING_DEFLATE
+
+        return self.client.publish(topic, payload, 1)
 
     def disconnect(self):
         """
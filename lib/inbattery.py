@@ -0,0 +1,175 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103,R0913,R0902
+
+"""
+InnovateNow battery state of charge and energy budget.
+
+The battery voltage is the average of several ADC conversions, corrected
+for the voltage drop of the load (internal resistance) and the lower
+voltage of a cold LiPo, and mapped to the state of charge with a LiPo
+discharge curve. The charge spent per wake cycle (awake time and deepsleep)
+is estimated from the configured currents and kept in NVS.
+
+Subsystems query budget (1.0 with a healthy battery down to 0.0 near
+brown out) to scale down their sampling, GPS time and uplinks.
+"""
+
+import time
+
+from innvs import NVS
+
+# Initialize logging
+import inlogging as logging
+log = logging.getLogger(__name__)
+
+# LiPo open circuit voltage to state of charge percentage (at 25 celsius)
+LIPO_CURVE = ((3.50, 0), (3.60, 2), (3.70, 5), (3.75, 10), (3.79, 20), (3.83, 30),
+              (3.87, 40), (3.92, 50), (3.97, 60), (4.02, 70), (4.08, 80), (4.13, 90),
+              (4.20, 100))
+
+# NVS keys
+NVS_BATTERY_USED = 'bat_used'   # Charge spent since reset of the counter in uAh
+NVS_BATTERY_WAKE = 'bat_wake'   # Average charge of a wake cycle in uAh (smoothed)
+
+
+def state_of_charge(voltage=0):
+    """ Return the state of charge percentage of the LiPo open circuit voltage """
+    if voltage <= LIPO_CURVE[0][0]:
+        return 0
+
+    for i in range(1, len(LIPO_CURVE)):
+        v1, soc1 = LIPO_CURVE[i]
+        if voltage <= v1:
+            v0, soc0 = LIPO_CURVE[i - 1]
+            return int(soc0 + (soc1 - soc0) * (voltage - v0) / (v1 - v0))
+
+    return 100
+
+
+class Battery(object):
+    """
+    Battery state of charge and energy budget of the wake cycles
+    """
+
+    def __init__(self, py=None, samples=8, capacity_mah=2000, resistance=0.15,
+                 awake_ma=60, sleep_ua=20, temperature_coefficient=0.0015,
+                 soc_low=10, soc_high=40):
+        """
+        Initialize the battery
+        samples: number of ADC conversions to average
+        resistance: internal resistance in ohm, corrects the voltage drop of awake_ma
+        awake_ma, sleep_ua: average current while awake and during deepsleep
+        temperature_coefficient: LiPo voltage drop in volt per celsius below 25 celsius
+        soc_low, soc_high: state of charge where the budget is 0.0 and 1.0
+        """
+        self.py = py
+        self.samples = samples
+        self.capacity_mah = capacity_mah
+        self.resistance = resistance
+        self.awake_ma = awake_ma
+        self.sleep_ua = sleep_ua
+        self.temperature_coefficient = temperature_coefficient
+        self.soc_low = soc_low
+        self.soc_high = soc_high
+        self.voltage = None     # Measured (loaded) voltage
+        self.soc = None         # State of charge percentage
+        self.start = time.ticks_ms()
+
+    def measure(self, temperature=None):
+        """
+        Measure the voltage and estimate the state of charge
+        temperature: battery temperature in celsius (BME280) or None
+        """
+        adc = 0
+        for _ in range(self.samples):
+            adc += self.py.read_battery_adc()
+        self.voltage = self.py.battery_adc_to_voltage(adc / self.samples)
+
+        # Open circuit voltage at 25 celsius
+        ocv = self.voltage + self.awake_ma * self.resistance / 1000
+        if temperature is not None and temperature < 25:
+            ocv += (25 - temperature) * self.temperature_coefficient
+
+        self.soc = state_of_charge(ocv)
+        log.debug('Battery {:.2f}V, {}%', self.voltage, self.soc)
+        return self.soc
+
+    @property
+    def remaining_mah(self):
+        """ Estimated charge left in mAh """
+        return self.capacity_mah * (self.soc or 0) // 100
+
+    @property
+    def budget(self):
+        """
+        Energy budget from 1.0 (soc_high and above) to 0.0 (soc_low and
+        below), 1.0 when not measured
+        """
+        if self.soc is None:
+            return 1.0
+
+        if self.soc >= self.soc_high:
+            return 1.0
+
+        if self.soc <= self.soc_low:
+            return 0.0
+
+        return (self.soc - self.soc_low) / (self.soc_high - self.soc_low)
+
+    def scale(self, value=0, minimum=0):
+        """ Scale a count (samples, retries) down with the budget, never below minimum """
+        return max(minimum, int(value * self.budget))
+
+    def stretch(self, seconds=0, maximum=None):
+        """ Stretch an interval up with a lower budget (up to 10 times), never above maximum """
+        seconds = int(seconds / max(0.1, self.budget))
+        return min(seconds, maximum) if maximum else seconds
+
+    @property
+    def wake_mah(self):
+        """ Average charge of a wake cycle in mAh or None when unknown """
+        wake = NVS.get(NVS_BATTERY_WAKE)
+        return wake / 1000 if wake else None
+
+    @property
+    def used_mah(self):
+        """ Charge spent since the counter reset in mAh """
+        return NVS.get(NVS_BATTERY_USED, 0) / 1000
+
+    def spend(self, sleep=0):
+        """
+        Register the charge of this wake cycle: the awake time until now and
+        the deepsleep of sleep seconds. Returns the charge in uAh
+        """
+        awake_ms = time.ticks_diff(time.ticks_ms(), self.start)
+        uah = self.awake_ma * awake_ms // 3600 + self.sleep_ua * sleep // 3600
+
+        NVS.set(NVS_BATTERY_USED, NVS.get(NVS_BATTERY_USED, 0) + uah)
+        wake = NVS.get(NVS_BATTERY_WAKE)
+        NVS.set(NVS_BATTERY_WAKE, uah if wake is None else (wake * 7 + uah) // 8)
+
+        log.debug('Wake cycle {}ms, {}uAh', awake_ms, uah)
+        return uah
+
+    @staticmethod
+    def reset():
+        """ Reset the spent charge counter (battery replaced or charged) """
+        NVS.set(NVS_BATTERY_USED, 0)
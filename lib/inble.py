@@ -22,40 +22,247 @@
 """ BLE scanner for beacons and tags """
 
 import binascii
+import struct
 import sys
+import time
 from network import Bluetooth
+from infiles import File
 
 # Initialize logging
 import inlogging as logging
 log = logging.getLogger(__name__)
 
+# Device record fields
+FIRST_SEEN = 0
+LAST_SEEN = 1
+COUNT = 2
+RSSI_MIN = 3
+RSSI_MAX = 4
+RSSI_SUM = 5
+TX_POWER = 6
+
+# Beacon key types
+KEY_IBEACON = 0x01
+KEY_EDDYSTONE_UID = 0x02
+
+# Apple iBeacon manufacturer data prefix (company id, type, length)
+IBEACON_PREFIX = b'\x4c\x00\x02\x15'
+
+# Eddystone service UUID (little endian) and frame types
+EDDYSTONE_UUID = b'\xaa\xfe'
+EDDYSTONE_UID = 0x00
+EDDYSTONE_TLM = 0x20
+
+# Eviction policy when the device store is full
+EVICT_LRU = 0   # Least recently seen device
+EVICT_RSSI = 1  # Weakest (mean RSSI) device
+
+def decode_ibeacon(data):
+    """
+    Decode iBeacon manufacturer data
+    Returns (uuid, major, minor, tx_power) or None when not an iBeacon
+    """
+    if len(data) < 25 or data[0:4] != IBEACON_PREFIX:
+        return None
+
+    major, minor, tx_power = struct.unpack('>HHb', data[20:25])
+    return (bytes(data[4:20]), major, minor, tx_power)
+
+
+def decode_eddystone(data):
+    """
+    Decode Eddystone service data
+    Returns (EDDYSTONE_UID, (namespace, instance, tx_power)) or
+            (EDDYSTONE_TLM, (battery mV, temperature centi celsius, adv count, sec count))
+    or None when not a supported Eddystone frame
+    """
+    if len(data) < 3 or data[0:2] != EDDYSTONE_UUID:
+        return None
+
+    frame_type = data[2]
+    if frame_type == EDDYSTONE_UID and len(data) >= 20:
+        tx_power = struct.unpack('b', data[3:4])[0]
+        return (EDDYSTONE_UID, (bytes(data[4:14]), bytes(data[14:20]), tx_power))
+
+    if frame_type == EDDYSTONE_TLM and len(data) >= 16:
+        vbatt, temp, adv_cnt, sec_cnt = struct.unpack('>HhII', data[4:16])
+        return (EDDYSTONE_TLM, (vbatt, (temp * 100) // 256, adv_cnt, sec_cnt))
+
+    return None
+
+
+class FleetFilter(object):
+    """
+    Compact whitelist of fleet device MACs loaded from flash, created on the
+    host with tools/fleet_filter.py. Two file formats are supported:
+        Bloom filter: 'BLM1', hashes k (1), pad (3), bits m (4), bit array
+        Sorted MACs:  'MAC1', count (4), sorted 6 byte MACs (binary search)
+    A Bloom filter uses ~10 bits per MAC at 1% false positives.
+    """
+
+    def __init__(self, file=None):
+        data = File.read_bytes(file)
+        self._magic = data[0:4]
+
+        if self._magic == b'BLM1':
+            self._k = data[4]
+            self._m = struct.unpack_from('<I', data, 8)[0]
+            self._data = data[12:]
+        elif self._magic == b'MAC1':
+            self._count = struct.unpack_from('<I', data, 4)[0]
+            self._data = data[8:]
+        else:
+            raise ValueError('Unknown fleet filter format')
+
+        log.info('Fleet filter {} loaded ({} bytes)', self._magic, len(self._data))
+
+    def contains(self, mac):
+        """ Return True when the MAC (6 bytes) is in the fleet """
+        if self._magic == b'BLM1':
+            h1 = binascii.crc32(mac)
+            h2 = binascii.crc32(mac, h1) | 1
+            for i in range(self._k):
+                bit = (h1 + i * h2) % self._m
+                if not self._data[bit >> 3] & (1 << (bit & 7)):
+                    return False
+            return True
+
+        low = 0
+        high = self._count - 1
+        while low <= high:
+            mid = (low + high) >> 1
+            item = self._data[mid * 6:mid * 6 + 6]
+            if item == mac:
+                return True
+            if item < mac:
+                low = mid + 1
+            else:
+                high = mid - 1
+        return False
+
+
 class BLEScanner(object):
-    """ BLE scanner for beacons and tags data packages """
+    """
+    BLE scanner for beacons and tags data packages
+    Devices are indexed on the raw MAC (tags) or manufacturer data (beacons)
+    bytes with per device first/last seen, advertisement count and RSSI
+    statistics. Hex strings are only made when reporting.
+    The beacon and tag stores hold at most capacity devices each, when full
+    a device is evicted according to the eviction policy. Only the strongest
+    max_list_items devices are reported.
+    iBeacons and Eddystone UID beacons of registered UUIDs (iBeacon UUID or
+    Eddystone namespace) are stored as compact keys: key type, 1 byte UUID
+    index and major/minor or instance. When UUIDs are registered, beacons
+    of other UUIDs are ignored.
+    """
 
-    def __init__(self, max_list_items=25):
+    def __init__(self, max_list_items=25, capacity=100, evict=EVICT_LRU,
+                 ring_size=32, batch_interval_ms=100, fleet=None):
 
-        self._beacons = []
-        self._tags = []
+        self._beacons = {}
+        self._tags = {}
 
         self._max_list_items = max_list_items
+        self._capacity = max(capacity, max_list_items)
+        self._evict = evict
+        self._evictions = 0
+        self._uuids = {}
+        self._uuid_list = []
+        self._telemetry = {}
         self._ble = None
+        self._fleet = fleet
+        self._rejected = 0
 
-    def start(self, timeout=-1):
-        """ Start beacon scanning """
+        # Ring of pending advertisements, filled by the BLE callback
+        # (single producer) and drained by process() (single consumer)
+        self._ring = [None] * ring_size
+        self._ring_head = 0
+        self._ring_tail = 0
+        self._ring_dropped = 0
+        self._batch_interval_ms = batch_interval_ms
+
+    def register_uuids(self, uuids=None):
+        """
+        Register the whitelist of iBeacon UUIDs and Eddystone namespaces
+        (hex strings, max 128, bit 0x80 of the index marks Eddystone in the
+        beacon frame). The position in the list is the reported index.
+        """
+        self._uuid_list = [binascii.unhexlify(u.replace('-', '')) for u in (uuids or [])][:128]
+        self._uuids = dict((u, i) for i, u in enumerate(self._uuid_list))
+
+    def start(self, timeout=-1, blocking=True):
+        """
+        Start beacon scanning
+        Advertisements are queued by the BLE callback and processed in
+        batches. When not blocking the caller must call process() regularly
+        (e.g. between GPS reads) while is_scanning.
+        """
 
         log.info('Start scanning for beacons and tags')
         if self._ble is None:
             self._ble = Bluetooth()
 
+        self._ble.callback(trigger=Bluetooth.NEW_ADV_EVENT, handler=self.__adv_handler)
         self._ble.start_scan(timeout)
-        while self._ble.isscanning():
-            self.beacon_data_collect()
+
+        if blocking:
+            while self._ble.isscanning():
+                self.process()
+                time.sleep_ms(self._batch_interval_ms) # Idle between batches
+            self.process()
+
+    @property
+    def is_scanning(self):
+        """ Return if the scan is running """
+        return self._ble is not None and self._ble.isscanning()
+
+    @property
+    def rejected(self):
+        """ Return the number of advertisements rejected by the fleet filter """
+        return self._rejected
+
+    @property
+    def dropped(self):
+        """ Return the number of advertisements dropped because the ring was full """
+        return self._ring_dropped
+
+    def process(self):
+        """ Process the pending advertisements, returns the number processed """
+        count = 0
+        size = len(self._ring)
+        while self._ring_tail != self._ring_head:
+            adv = self._ring[self._ring_tail]
+            self._ring[self._ring_tail] = None
+            self._ring_tail = (self._ring_tail + 1) % size
+            self.__collect(adv)
+            count += 1
+        return count
+
+    def __adv_handler(self, bt):
+        """ BLE callback, queue the new advertisements """
+        size = len(self._ring)
+        adv = bt.get_adv()
+        while adv:
+            if self._fleet and not self._fleet.contains(adv.mac):
+                self._rejected += 1
+                adv = bt.get_adv()
+                continue
+
+            head = (self._ring_head + 1) % size
+            if head == self._ring_tail:
+                self._ring_dropped += 1
+            else:
+                self._ring[self._ring_head] = adv
+                self._ring_head = head
+            adv = bt.get_adv()
 
     def stop(self):
         """ Stop BLE """
         log.info('Stop scanning for beacons and tags')
         if self._ble:
             self._ble.stop_scan()
+            self._ble.callback(trigger=Bluetooth.NEW_ADV_EVENT, handler=None)
+            self.process()
             #self._ble.deinit()
             #self._ble = None
 
@@ -66,47 +273,330 @@ class BLEScanner(object):
     def reset(self):
         """ Reset the retrieved beacon/tag list during scanning """
         log.info('Reset beacon/tag list')
-        self._beacons[:] = []
-        self._tags[:] = []
+        self._beacons.clear()
+        self._tags.clear()
+        self._telemetry.clear()
+        self._evictions = 0
+
+    @property
+    def evictions(self):
+        """ Return the number of devices evicted because the store was full """
+        return self._evictions
+
+    @property
+    def beacon_ids(self):
+        """ Return all beacons found """
+        return [binascii.hexlify(key).decode('UTF-8') for key in self._beacons]
+
+    @property
+    def tag_ids(self):
+        """ Return all tags found """
+        return [binascii.hexlify(key).decode('UTF-8') for key in self._tags]
 
     @property
     def beacons(self):
-        """ Return the beacons found """
-        res = list(self._beacons) # make a copy
-        return res
+        """ Return the strongest beacons found """
+        return [binascii.hexlify(key).decode('UTF-8') for key in self.__strongest(self._beacons)]
 
     @property
     def tags(self):
-        """ Return the tags found """
-        res = list(self._tags) # make a copy
+        """ Return the strongest tags found """
+        return [binascii.hexlify(key).decode('UTF-8') for key in self.__strongest(self._tags)]
+
+    @property
+    def beacon_records(self):
+        """ Return the strongest beacons decoded to dicts """
+        res = []
+        for key in self.__strongest(self._beacons):
+            rec = self._beacons[key]
+            item = {'rssi': rec[RSSI_SUM] // rec[COUNT], 'tx': rec[TX_POWER]}
+
+            if key[0] == KEY_IBEACON and len(key) == 6:
+                item['type'] = 'ibeacon'
+                item['uuid'] = key[1]
+                item['major'], item['minor'] = struct.unpack('>HH', key[2:6])
+            elif key[0] == KEY_EDDYSTONE_UID and len(key) == 8:
+                item['type'] = 'eddystone'
+                item['uuid'] = key[1]
+                item['instance'] = binascii.hexlify(key[2:8]).decode('UTF-8')
+            else:
+                item['type'] = 'raw'
+                item['data'] = binascii.hexlify(key).decode('UTF-8')
+
+            res.append(item)
+        return res
+
+    @property
+    def telemetry(self):
+        """ Return the Eddystone TLM data per MAC """
+        return [{'mac': binascii.hexlify(mac).decode('UTF-8'), 'battery': tlm[0],
+                 'temperature': tlm[1], 'advCount': tlm[2], 'secCount': tlm[3]}
+                for mac, tlm in self._telemetry.items()]
+
+    def beacon_frame(self, max_items=None):
+        """
+        Return the strongest registered beacons as compact binary frame:
+        the number of beacons (1) followed per beacon by
+            iBeacon:   uuid index (1), major (2), minor (2), rssi (1)
+            Eddystone: 0x80 | uuid index (1), instance (6), rssi (1)
+        """
+        frame = bytearray(1)
+        count = 0
+        for key in self.__strongest(self._beacons):
+            if max_items is not None and count >= max_items:
+                break
+
+            rec = self._beacons[key]
+            rssi = (rec[RSSI_SUM] // rec[COUNT]) & 0xFF
+
+            if key[0] == KEY_IBEACON and len(key) == 6 and key[1] < 0x80:
+                frame.extend(key[1:6])
+            elif key[0] == KEY_EDDYSTONE_UID and len(key) == 8 and key[1] < 0x80:
+                frame.append(0x80 | key[1])
+                frame.extend(key[2:8])
+            else:
+                continue
+
+            frame.append(rssi)
+            count += 1
+
+        frame[0] = count
+        return bytes(frame)
+
+    def __strongest(self, index):
+        """ Return the keys of the max_list_items strongest devices """
+        keys = list(index)
+        if len(keys) > self._max_list_items:
+            keys.sort(key=lambda k: index[k][RSSI_SUM] // index[k][COUNT], reverse=True)
+            keys = keys[:self._max_list_items]
+        return keys
+
+    @property
+    def beacon_stats(self):
+        """ Return the beacons found with their statistics """
+        return self.__stats(self._beacons)
+
+    @property
+    def tag_stats(self):
+        """ Return the tags found with their statistics """
+        return self.__stats(self._tags)
+
+    def __stats(self, index):
+        """ Transform the index to a list of dicts """
+        res = []
+        for key in self.__strongest(index):
+            rec = index[key]
+            res.append({'id': binascii.hexlify(key).decode('UTF-8'),
+                        'firstSeen': rec[FIRST_SEEN],
+                        'lastSeen': rec[LAST_SEEN],
+                        'count': rec[COUNT],
+                        'rssiMin': rec[RSSI_MIN],
+                        'rssiMax': rec[RSSI_MAX],
+                        'rssiMean': rec[RSSI_SUM] // rec[COUNT]})
         return res
 
+    def __update(self, index, key, rssi, tx_power=None):
+        """ Update the device record, returns True for a new device """
+        rec = index.get(key)
+        now = time.time()
+
+        if rec is None:
+            if len(index) >= self._capacity and not self.__evict(index, rssi):
+                return False
+
+            index[key] = [now, now, 1, rssi, rssi, rssi, tx_power]
+            return True
+
+        rec[LAST_SEEN] = now
+        rec[COUNT] += 1
+        if rssi < rec[RSSI_MIN]:
+            rec[RSSI_MIN] = rssi
+        if rssi > rec[RSSI_MAX]:
+            rec[RSSI_MAX] = rssi
+        rec[RSSI_SUM] += rssi
+        return False
+
+    def __evict(self, index, rssi):
+        """
+        Make room in the full store, returns False when the new device
+        with rssi should not be stored (weaker than all stored devices)
+        """
+        victim = None
+        if self._evict == EVICT_RSSI:
+            weakest = rssi
+            for key, rec in index.items():
+                mean = rec[RSSI_SUM] // rec[COUNT]
+                if mean < weakest:
+                    victim, weakest = key, mean
+        else:
+            oldest = None
+            for key, rec in index.items():
+                if oldest is None or rec[LAST_SEEN] < oldest:
+                    victim, oldest = key, rec[LAST_SEEN]
+
+        if victim is None:
+            return False
+
+        del index[victim]
+        self._evictions += 1
+        return True
+
     def beacon_data_collect(self):
-        """ Collect the beacon data """
+        """ Collect the beacon data of one polled advertisement """
 
         adv = self._ble.get_adv()
+        if adv:
+            if self._fleet and not self._fleet.contains(adv.mac):
+                self._rejected += 1
+                return
+
+            self.__collect(adv)
+
+    def __collect(self, adv):
+        """ Collect the beacon data of the advertisement """
+
         if adv:
 
-            if self._ble.resolve_adv_data(adv.data, Bluetooth.ADV_NAME_CMPL) == "ITAG":
+            # Known tag, no need to resolve the name
+            if adv.mac in self._tags:
+                self.__update(self._tags, adv.mac, adv.rssi)
 
-                binitag = binascii.hexlify(adv[0])
-                tag = binitag.decode('UTF-8')
+            elif self._ble.resolve_adv_data(adv.data, Bluetooth.ADV_NAME_CMPL) == "ITAG":
 
-                if tag not in self._tags:
-                    log.debug('Found tag [{}]', tag)
-                    self._tags.append(tag)
+                if self.__update(self._tags, adv.mac, adv.rssi):
+                    log.debug('Found tag [{}]', binascii.hexlify(adv.mac))
 
             else:
 
-                # try to get the complete name only works with ibeacons
+                # try to get the manufacturer data (Apple's iBeacon data is sent here)
                 data = self._ble.resolve_adv_data(adv.data, Bluetooth.ADV_MANUFACTURER_DATA)
 
                 if data:
-                    # try to get the manufacturer data (Apple's iBeacon data is sent here)
-                    bindata = binascii.hexlify(data)
-                    beacon = bindata.decode('UTF-8')
-
-                    # Check if beacon is in list
-                    if beacon not in self._beacons:
-                        log.debug('Found beacon [{}]', beacon)
-                        self._beacons.append(beacon)
+                    self.__collect_ibeacon(adv, data)
+                else:
+                    # Eddystone frames are sent as service data
+                    data = self._ble.resolve_adv_data(adv.data, Bluetooth.ADV_SERVICE_DATA)
+                    if data:
+                        self.__collect_eddystone(adv, data)
+
+    def __collect_ibeacon(self, adv, data):
+        """ Store the iBeacon (or other manufacturer data) """
+        tx_power = None
+        ibeacon = decode_ibeacon(data)
+
+        if ibeacon:
+            uuid, major, minor, tx_power = ibeacon
+            idx = self._uuids.get(uuid)
+            if idx is not None:
+                key = struct.pack('>BBHH', KEY_IBEACON, idx, major, minor)
+            elif self._uuids:
+                return # Not whitelisted
+            else:
+                key = bytes(data)
+        elif self._uuids:
+            return # Not whitelisted
+        else:
+            key = bytes(data)
+
+        if self.__update(self._beacons, key, adv.rssi, tx_power):
+            log.debug('Found beacon [{}]', binascii.hexlify(key))
+
+    def __collect_eddystone(self, adv, data):
+        """ Store the Eddystone UID beacon or TLM telemetry """
+        eddystone = decode_eddystone(data)
+        if eddystone is None:
+            return
+
+        frame_type, fields = eddystone
+        if frame_type == EDDYSTONE_TLM:
+            if adv.mac in self._telemetry or len(self._telemetry) < self._capacity:
+                self._telemetry[adv.mac] = fields
+            return
+
+        namespace, instance, tx_power = fields
+        idx = self._uuids.get(namespace)
+        if idx is None:
+            if self._uuids:
+                return # Not whitelisted
+            key = bytes([KEY_EDDYSTONE_UID]) + namespace + instance
+        else:
+            key = bytes([KEY_EDDYSTONE_UID, idx]) + instance
+
+        if self.__update(self._beacons, key, adv.rssi, tx_power):
+            log.debug('Found beacon [{}]', binascii.hexlify(key))
+
+
+class BeaconPresence(object):
+    """
+    Report only the beacons and tags that entered or left since the previous
+    report, with a full keyframe every keyframe_interval reports.
+    The previously reported set is persisted on flash as CRC32 hashes of the
+    reported ids, so ids that left are reported as 8 character hex hashes.
+    Every report has a sequence number, a delta applies to the report with
+    the previous sequence number. The reported set is only persisted by
+    save(), once the report was sent or stored in the backlog.
+    """
+
+    def __init__(self, file='/flash/presence.bin', keyframe_interval=12):
+        self.file = file
+        self.keyframe_interval = keyframe_interval
+        self.__pending = None
+
+    def __load(self):
+        """ Return (report counter, beacon hashes, tag hashes) """
+        if not File.exists(self.file):
+            return (0, set(), set())
+
+        data = File.read_bytes(self.file)
+        counter, beacons, tags = struct.unpack_from('<IHH', data)
+        hashes = struct.unpack_from('<{}I'.format(beacons + tags), data, 8)
+        return (counter, set(hashes[:beacons]), set(hashes[beacons:]))
+
+    def save(self):
+        """ Persist the report counter and the hashes of the last update() """
+        if self.__pending is None:
+            return
+
+        counter, beacons, tags = self.__pending
+        data = struct.pack('<IHH', counter, len(beacons), len(tags)) + \
+               struct.pack('<{}I'.format(len(beacons) + len(tags)), *(list(beacons) + list(tags)))
+        File.write_bytes(self.file, data)
+        self.__pending = None
+
+    @staticmethod
+    def __delta(ids, previous):
+        """ Return (hashes, entered ids, left hex hashes) """
+        hashes = {}
+        for i in ids:
+            hashes[binascii.crc32(i.encode())] = i
+
+        entered = [i for h, i in hashes.items() if h not in previous]
+        left = ['{:08x}'.format(h) for h in previous if h not in hashes]
+        return (set(hashes), entered, left)
+
+    def update(self, beacons=None, tags=None):
+        """
+        Compare the current beacon and tag ids with the reported set
+        Returns (sequence, keyframe, beacons, beacons left, tags, tags left),
+        for a keyframe beacons and tags are the complete lists and nothing left
+        """
+        beacons = beacons or []
+        tags = tags or []
+        counter, prev_beacons, prev_tags = self.__load()
+
+        keyframe = counter % self.keyframe_interval == 0
+        beacon_hashes, beacons_entered, beacons_left = self.__delta(beacons, prev_beacons)
+        tag_hashes, tags_entered, tags_left = self.__delta(tags, prev_tags)
+
+        self.__pending = (counter + 1, beacon_hashes, tag_hashes)
+
+        if keyframe:
+            return (counter, True, beacons, [], tags, [])
+
+        return (counter, False, beacons_entered, beacons_left, tags_entered, tags_left)
+
+    def reset(self):
+        """ Forget the reported set, the next report is a keyframe """
+        self.__pending = None
+        if File.exists(self.file):
+            File.delete(self.file)
@@ -0,0 +1,152 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103,W0703
+
+"""
+InnovateNow payload compression (zlib/deflate) for MQTT uplinks.
+
+Uses zlib on CPython and uzlib/deflate on the device when the firmware
+provides a compressor. When no compressor is available compress() returns
+None and the caller sends the payload uncompressed.
+"""
+
+import time
+
+# Initialize logging
+import inlogging as logging
+log = logging.getLogger(__name__)
+
+# Content encoding marker appended to the topic of compressed payloads
+ENCODING_DEFLATE = 'deflate'
+
+_compressor = None
+
+try:
+    import zlib
+    _compressor = zlib.compress
+except (ImportError, AttributeError):
+    try:
+        import uzlib
+        _compressor = uzlib.compress
+    except (ImportError, AttributeError):
+        try:
+            import io
+            import deflate
+
+            def _deflate_compress(data):
+                buf = io.BytesIO()
+                with deflate.DeflateIO(buf, deflate.ZLIB) as stream:
+                    stream.write(data)
+                return buf.getvalue()
+
+            _compressor = _deflate_compress
+        except (ImportError, AttributeError):
+            _compressor = None
+
+
+def available():
+    """ Return True when the platform can compress payloads """
+    return _compressor is not None
+
+
+def compress(data=None):
+    """
+    Compress the data (str or bytes) with zlib/deflate
+    Returns the compressed bytes or None when compression is not possible
+    """
+    if _compressor is None or not data:
+        return None
+
+    if isinstance(data, str):
+        data = data.encode('UTF-8')
+
+    try:
+        return _compressor(data)
+    except Exception as e:
+        log.error('Compression failed {}', e)
+        return None
+
+
+def _ticks_us():
+    """ Microsecond ticks on MicroPython and CPython """
+    if hasattr(time, 'ticks_us'):
+        return time.ticks_us()
+    return int(time.perf_counter() * 1000000)
+
+
+def _ticks_diff(end, start):
+    """ Difference between two tick values """
+    if hasattr(time, 'ticks_diff'):
+        return time.ticks_diff(end, start)
+    return end - start
+
+
+def beacon_scan_payload(beacons=10, tags=0):
+    """
+    Build a representative AWS beacon-scan payload (json str) with the
+    given number of iBeacon manufacturer data strings and iTAG addresses
+    """
+    import json
+    from inmsg import AWSMessage, EnvironMessage, GPSMessage
+
+    beacon_list = []
+    for i in range(beacons):
+        # Apple iBeacon: company id, type, length, uuid, major, minor, tx power
+        beacon_list.append('4c000215' + 'e2c56db5dffb48d2b060d0f5a71096e0' +
+                           '{0:04x}{1:04x}c5'.format(i // 16, i))
+
+    tag_list = []
+    for i in range(tags):
+        tag_list.append('ffff{0:08x}'.format(0xa0b1c200 + i))
+
+    msg = AWSMessage(customer='InnovateNow', device_id='240ac4c0ffee',
+                     environ_message=EnvironMessage(temperature=4.52, humidity=81,
+                                                    barometric_pressure=1013).to_dict(),
+                     gps_message=GPSMessage(latitude=52.0907, longitude=5.1214,
+                                            speed=0).to_dict(),
+                     beacons=beacon_list, tags=tag_list)
+
+    return json.dumps(msg.to_dict())
+
+
+def benchmark(sizes=(0, 5, 25, 100), rounds=5):
+    """
+    Benchmark compression ratio against CPU time for beacon-scan payloads
+    Returns a list of (beacons, raw bytes, compressed bytes, ratio, us per compress)
+    """
+    results = []
+    if not available():
+        log.warning('No compressor available for benchmark')
+        return results
+
+    for size in sizes:
+        payload = beacon_scan_payload(beacons=size).encode('UTF-8')
+
+        start = _ticks_us()
+        for _ in range(rounds):
+            compressed = compress(payload)
+        elapsed = _ticks_diff(_ticks_us(), start) // rounds
+
+        ratio = len(compressed) / len(payload)
+        results.append((size, len(payload), len(compressed), ratio, elapsed))
+        log.info('Beacons {} raw {} compressed {} ratio {:.2f} {}us',
+                 size, len(payload), len(compressed), ratio, elapsed)
+
+    return results
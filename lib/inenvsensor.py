@@ -23,7 +23,11 @@
 InnovateNow Environment Sensor based on:
     - BME280 sensor for Temperature, Humidity and Barometric pressure
 """
+import time
+import struct
+from array import array
 import BME280 as bme280
+from infiles import File
 
 # Initialize logging
 import inlogging as logging
@@ -34,43 +38,175 @@ class Environment(object):
     Class for getting the Enviroment sensor values
     """
 
-    def __init__(self, i2c=None):
+    def __init__(self, i2c=None, ttl=1000, preset='weather'):
         """
         Initialize the enviromental sensor
+        ttl: milliseconds a sample is reused before a new measurement is done
+        preset: BME280 sampling preset (see BME280.BME280_PRESETS)
         """
         self.i2c = i2c
+        self.ttl = ttl
+        self.bme280 = None
+        self._sample = None
+        self._sample_ticks = None
+        self._compensated = array('i', [0, 0, 0])
 
         if self.i2c:
-            self.addresses = self.i2c.scan()
+            self.addresses = self.i2c.scan() # Cached by ini2c.I2CBus
 
             log.info('I2C addresses [{}]', self.addresses)
             
-            self.bme280 = None
             if bme280.BME280_I2CADDR1 in self.addresses:
                 log.info('Initialize Temperature, Humidity and Barometric sensor on {}', bme280.BME280_I2CADDR1)
                 self.bme280 = bme280.BME280(address=bme280.BME280_I2CADDR1,
-                                            i2c=i2c) # default address 0x76s
+                                            i2c=i2c, preset=preset) # default address 0x76s
 
             if bme280.BME280_IC2ADDR2 in self.addresses:
                 log.info('Initialize Temperature, Humidity and Barometric sensor on {}', bme280.BME280_IC2ADDR2)
                 self.bme280 = bme280.BME280(address=bme280.BME280_IC2ADDR2,
-                                            i2c=i2c) # default address 0x77
+                                            i2c=i2c, preset=preset) # default address 0x77
 
 
+    def compensated(self):
+        """
+        Return the integer measurement as array (temperature centi celsius,
+        barometric pressure Pa, humidity 1/1024 percentage), cached for ttl
+        milliseconds. The array is reused by the next measurement.
+        """
+        if self.bme280 is None:
+            return None
+
+        now = time.ticks_ms()
+        if self._sample_ticks is None or time.ticks_diff(now, self._sample_ticks) > self.ttl:
+            self.bme280.read_compensated_data(self._compensated)
+            self._compensated[1] >>= 8 # Q24.8 Pa to Pa
+            self._sample = None
+            self._sample_ticks = now
+
+        return self._compensated
+
+    def sample(self):
+        """
+        Return the (temperature celsius, barometric pressure hPa, humidity percentage)
+        snapshot of one measurement, cached for ttl milliseconds
+        """
+        compensated = self.compensated()
+        if compensated is None:
+            return None
+
+        if self._sample is None:
+            t, p, h = compensated
+            self._sample = (t / 100, p / 100, h / 1024)
+
+        return self._sample
+
+    def burst(self):
+        """
+        Return the raw 8 bytes measurement (one I2C burst) without compensation,
+        the bytearray is reused by the next measurement
+        """
+        if self.bme280 is None:
+            return None
+
+        return self.bme280.read_burst()
+
     @property
     def temperature(self):
         """Return the current temperature in celsius"""
         if self.bme280:
-            return self.bme280.temperature
+            return self.sample()[0]
 
     @property
     def humidity(self):
         """Return the current humidity percentage"""
         if self.bme280:
-            return self.bme280.humidity
+            return self.sample()[2]
 
     @property
     def barometric_pressure(self):
         """Return the current barometric pressure in hPa"""
         if self.bme280:
-            return self.bme280.pressure
+            return self.sample()[1]
+
+
+class RawSamples(object):
+    """
+    Raw BME280 measurements stored on flash for deferred compensation
+    File: 'BMR1', the calibration data once, then per sample the time
+    (uint32) and the 8 bytes burst. Compensated in batch at uplink time or
+    on the host (tools/bme280_batch.py).
+    """
+
+    RECORD = '>I8s'
+    RECORD_SIZE = 12
+
+    def __init__(self, file='/flash/envraw.bin', max_items=1024):
+        self.file = file
+        self.max_items = max_items
+        self.count = 0
+        if File.exists(self.file):
+            self.count = (File.size(self.file) - 4 - bme280.BME280_CALIBRATION_SIZE) \
+                         // self.RECORD_SIZE
+
+    def add(self, environ=None, now=None):
+        """ Store one raw measurement of the Environment, returns True when stored """
+        if self.count >= self.max_items:
+            return False
+
+        burst = environ.burst() if environ else None
+        if burst is None:
+            return False
+
+        if not self.count:
+            File.write_bytes(self.file, b'BMR1' + environ.bme280.calibration_data)
+
+        File.append_bytes(self.file, struct.pack(self.RECORD, time.time() if now is None else now,
+                                                 bytes(burst)))
+        self.count += 1
+        return True
+
+    def sample(self, environ=None, seconds=0, interval=5, idle=None):
+        """
+        Store a raw measurement every interval seconds for seconds
+        (sleeps or calls idle(ms) in between), at least one measurement is taken
+        """
+        start = time.ticks_ms()
+        while True:
+            self.add(environ)
+            remaining = seconds * 1000 - time.ticks_diff(time.ticks_ms(), start)
+            if remaining <= 0:
+                break
+            (idle or time.sleep_ms)(min(remaining, interval * 1000))
+
+    def compensated(self):
+        """
+        Return the stored samples as list of (time, (temperature centi celsius,
+        pressure Pa, humidity 1/1024 percentage))
+        """
+        if not self.count:
+            return []
+
+        data = File.read_bytes(self.file)
+        if data[:4] != b'BMR1':
+            log.error('Invalid raw samples file {}', self.file)
+            return []
+
+        offset = 4 + bme280.BME280_CALIBRATION_SIZE
+        cal = bme280.calibration(data[4:offset])
+        raw = array('i', [0, 0, 0])
+        samples = []
+        for pos in range(offset, len(data) - self.RECORD_SIZE + 1, self.RECORD_SIZE):
+            now, burst = struct.unpack_from(self.RECORD, data, pos)
+            bme280.parse_burst(burst, raw)
+            result = array('i', [0, 0, 0])
+            bme280.compensate(cal, raw[0], raw[1], raw[2], result)
+            result[1] >>= 8 # Q24.8 Pa to Pa
+            samples.append((now, result))
+
+        return samples
+
+    def clear(self):
+        """ Remove all samples """
+        if File.exists(self.file):
+            File.delete(self.file)
+        self.count = 0
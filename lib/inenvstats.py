@@ -0,0 +1,216 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103,W0703
+
+"""
+InnovateNow streaming statistics of the environmental sensor over a reporting window.
+
+The BME280 is only sampled while awake, the window spans the wakes (and
+uplinks) of the reporting window. Per quantity the running min, max, mean
+and variance (Welford) are kept, plus the sampled time the temperature was
+above the high or below the low threshold. A gap between samples longer
+than max_gap (deepsleep) is not sampled and not counted. The accumulators are one array of floats and the
+time fields one array of unsigned ints (exact seconds, Pycom floats are
+single precision), O(1) memory, stored on flash so the window survives
+deepsleep. Values are in the integer units of Environment.compensated().
+"""
+
+import time
+from array import array
+
+from infiles import File
+
+# Initialize logging
+import inlogging as logging
+log = logging.getLogger(__name__)
+
+# Accumulator indexes
+N = 0           # Number of samples
+VALUES = 1      # Per quantity (temperature, pressure, humidity): min, max, mean, m2
+SIZE = VALUES + 3 * 4
+
+# Time field indexes
+LAST_TIME = 0   # Time of the last sample
+LAST_FLAGS = 1  # Last sample above high (1) or below low (2) threshold
+ABOVE = 2       # Seconds above the high threshold
+BELOW = 3       # Seconds below the low threshold
+FIRST_TIME = 4  # Time of the first sample, start of the window
+SAMPLED = 5     # Seconds covered by samples (gaps up to max_gap)
+TIMES_SIZE = 6
+
+
+class EnvironStats(object):
+    """
+    Running statistics window of the environmental sensor
+    """
+
+    def __init__(self, file='/flash/envstats.bin', high=None, low=None, window=None, max_gap=60):
+        """
+        Initialize the window, restored from file when available
+        high, low: temperature thresholds in celsius or None
+        window: seconds of the reporting window or None for every uplink
+        max_gap: max seconds between samples counted as sampled time
+        """
+        self.file = file
+        self.window = window
+        self.max_gap = max_gap
+        self.high = int(high * 100) if high is not None else None
+        self.low = int(low * 100) if low is not None else None
+        self.acc = array('f', [0] * SIZE)
+        self.times = array('I', [0] * TIMES_SIZE)
+
+        if File.exists(self.file):
+            try:
+                data = File.read_bytes(self.file)
+                split = len(bytes(self.acc))
+                acc = array('f', data[:split])
+                times = array('I', data[split:])
+                if len(acc) == SIZE and len(times) == TIMES_SIZE:
+                    self.acc = acc
+                    self.times = times
+            except Exception as e:
+                log.warning('Statistics window not restored {}', e)
+
+    @property
+    def count(self):
+        """ Number of samples in the window """
+        return int(self.acc[N])
+
+    def expired(self, now=None):
+        """ True when the reporting window is over (always without window) """
+        if self.window is None:
+            return True
+
+        now = int(time.time() if now is None else now)
+        return bool(self.acc[N]) and not 0 <= now - self.times[FIRST_TIME] < self.window
+
+    def add(self, compensated=None, now=None):
+        """
+        Add one measurement (temperature centi celsius, pressure Pa,
+        humidity 1/1024 percentage)
+        """
+        if not compensated:
+            return
+
+        acc = self.acc
+        times = self.times
+        now = int(time.time() if now is None else now)
+
+        # Time outside the thresholds, based on the previous sample (not across deepsleep)
+        if acc[N]:
+            elapsed = now - times[LAST_TIME]
+            if 0 < elapsed <= self.max_gap:
+                times[SAMPLED] += elapsed
+                if times[LAST_FLAGS] & 1:
+                    times[ABOVE] += elapsed
+                if times[LAST_FLAGS] & 2:
+                    times[BELOW] += elapsed
+
+        t = compensated[0]
+        flags = 0
+        if self.high is not None and t > self.high:
+            flags |= 1
+        if self.low is not None and t < self.low:
+            flags |= 2
+        times[LAST_FLAGS] = flags
+        times[LAST_TIME] = now
+        if not acc[N]:
+            times[FIRST_TIME] = now
+
+        # Welford
+        acc[N] += 1
+        n = acc[N]
+        for i in range(3):
+            value = compensated[i]
+            j = VALUES + i * 4
+            if n == 1:
+                acc[j] = acc[j + 1] = value
+                acc[j + 2] = value
+                acc[j + 3] = 0
+                continue
+
+            if value < acc[j]:
+                acc[j] = value
+            if value > acc[j + 1]:
+                acc[j + 1] = value
+            delta = value - acc[j + 2]
+            acc[j + 2] += delta / n
+            acc[j + 3] += delta * (value - acc[j + 2])
+
+    def sample(self, environ=None, seconds=0, interval=5, idle=None):
+        """
+        Sample the environment every interval seconds for seconds
+        (sleeps or calls idle(ms) in between), at least one sample is taken
+        """
+        start = time.ticks_ms()
+        while True:
+            self.add(environ.compensated())
+            remaining = seconds * 1000 - time.ticks_diff(time.ticks_ms(), start)
+            if remaining <= 0:
+                break
+            (idle or time.sleep_ms)(min(remaining, interval * 1000))
+
+    def summary(self):
+        """
+        Return the window as dict (celsius, hPa and percentage) or None when empty
+        """
+        acc = self.acc
+        n = acc[N]
+        if not n:
+            return None
+
+        summary = {'samples': int(n),
+                   'secondsSampled': self.times[SAMPLED],
+                   'secondsAbove': self.times[ABOVE],
+                   'secondsBelow': self.times[BELOW]}
+        for i, (name, scale) in enumerate((('temperature', 100), ('barometricPressure', 100),
+                                           ('humidity', 1024))):
+            j = VALUES + i * 4
+            variance = acc[j + 3] / (n - 1) if n > 1 else 0
+            summary[name] = {'min': round(acc[j] / scale, 2),
+                             'max': round(acc[j + 1] / scale, 2),
+                             'mean': round(acc[j + 2] / scale, 2),
+                             'stdev': round(variance ** 0.5 / scale, 2)}
+
+        return summary
+
+    def temperature(self):
+        """
+        Return the temperature (min, max, mean, stdev) in centi celsius and
+        the seconds above and below the thresholds as integers
+        """
+        acc = self.acc
+        n = acc[N]
+        variance = acc[VALUES + 3] / (n - 1) if n > 1 else 0
+        return (int(acc[VALUES]), int(acc[VALUES + 1]), int(acc[VALUES + 2]),
+                int(variance ** 0.5), self.times[ABOVE], self.times[BELOW])
+
+    def save(self):
+        """ Store the window on flash (before deepsleep) """
+        File.write_bytes(self.file, bytes(self.acc) + bytes(self.times))
+
+    def reset(self):
+        """ Start a new window (after the uplink that ends the window) """
+        for i in range(SIZE):
+            self.acc[i] = 0
+        for i in range(TIMES_SIZE):
+            self.times[i] = 0
+        if File.exists(self.file):
+            File.delete(self.file)
@@ -42,6 +42,68 @@ class File(object):
         fh.write(data)
         fh.close()
 
+    @staticmethod
+    def read_bytes(file=None):
+        """ Read the binary file at once """
+        fh = open(file, mode='rb')
+        data = fh.read()
+        fh.close()
+
+        return data
+
+    @staticmethod
+    def write_bytes(file=None, data=None):
+        """ Write the binary file at once """
+        fh = open(file, mode='wb')
+        fh.write(data)
+        fh.close()
+
+    @staticmethod
+    def read_at(file=None, offset=0, length=0):
+        """ Read length bytes at offset of the binary file """
+        fh = open(file, mode='rb')
+        fh.seek(offset)
+        data = fh.read(length)
+        fh.close()
+
+        return data
+
+    @staticmethod
+    def write_at(file=None, offset=0, data=None):
+        """ Overwrite the bytes at offset of the existing binary file """
+        fh = open(file, mode='r+b')
+        fh.seek(offset)
+        fh.write(data)
+        fh.close()
+
+    @staticmethod
+    def append(file=None, data=None, encoding='UTF-8'):
+        """ Append the data to the file """
+        fh = open(file, mode='a', encoding=encoding)
+        fh.write(data)
+        fh.close()
+
+    @staticmethod
+    def append_bytes(file=None, data=None):
+        """ Append the data to the binary file """
+        fh = open(file, mode='ab')
+        fh.write(data)
+        fh.close()
+
+    @staticmethod
+    def exists(file=None):
+        """ Check if file exists """
+        try:
+            os.stat(file)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def size(file=None):
+        """ Return the size of the file in bytes """
+        return os.stat(file)[6]
+
     @staticmethod
     def delete(file=None):
         """ Delete the specified file """
@@ -137,6 +137,7 @@ class GPS(object):
         self.is_running = False
         self.coords_valid = False    # Coordinates found
         self.is_valid = False        # All segments found
+        self.fix_ticks = None        # ticks_ms when the last valid time was parsed
         self.__timeout = timeout     # Data reader timeout in seconds
         self.__gps_segments = gps_segments
 
@@ -158,6 +159,9 @@ class GPS(object):
         for c in datareader.data:
             self.__parser.update(str(c))
 
+        if self.datetime is not None:
+            self.fix_ticks = time.ticks_ms()
+
         # Check if we found coords
         if self.__parser.latitude[0] != 0 and \
            self.__parser.longitude[0] != 0:
@@ -190,6 +194,19 @@ class GPS(object):
                                                                        self.__parser.timestamp[1],
                                                                        self.__parser.timestamp[2])
 
+    @property
+    def datetime(self):
+        """
+        Return the UTC (year, month, day, hours, minutes, seconds) of the last
+        valid RMC sentence or None when the receiver has no valid time yet
+        """
+        if not self.__parser.valid or self.__parser.date[2] == 0:
+            return None
+
+        return (2000 + self.__parser.date[2], self.__parser.date[1], self.__parser.date[0],
+                self.__parser.timestamp[0], self.__parser.timestamp[1],
+                int(self.__parser.timestamp[2]))
+
     def speed(self, unit='kph'):
         """
         Return speed
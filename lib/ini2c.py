@@ -0,0 +1,165 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103
+
+"""
+InnovateNow shared I2C bus of the Pytrack.
+
+One I2CBus owns the machine.I2C instance and is a drop-in replacement for
+it, so the Pytrack, GPS, BME280 and accelerometer share the same bus. The
+scan result is cached in NVS and only refreshed after a power on (not
+after deepsleep). Access is serialized with a lock, deinit() holds the
+lock until init(), so during Pycoproc.calibrate_rtc other threads wait for
+the bus instead of failing.
+"""
+
+import machine
+from machine import I2C
+
+from innvs import NVS
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+# Initialize logging
+import inlogging as logging
+log = logging.getLogger(__name__)
+
+# NVS key of the cached scan, a bitmap of the 128 addresses
+NVS_I2C_SCAN = 'i2c_scan'
+
+
+class _NoLock(object):
+    """ Lock without threads """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class I2CBus(object):
+    """
+    Shared I2C bus with a cached device scan
+    """
+
+    def __init__(self, bus_id=0, sda='P22', scl='P21'):
+        self.bus_id = bus_id
+        self.pins = (sda, scl)
+        self.i2c = I2C(bus_id, mode=I2C.MASTER, pins=self.pins)
+        self.lock = _thread.allocate_lock() if _thread else _NoLock()
+        self.active = True
+        self.__held = False
+        self.__addresses = None
+
+    def scan(self, refresh=False):
+        """
+        Return the device addresses, cached in NVS until the next power on
+        """
+        if self.__addresses is not None and not refresh:
+            return self.__addresses
+
+        bitmap = None
+        if not refresh and machine.reset_cause() == machine.DEEPSLEEP_RESET:
+            bitmap = NVS.get_bytes(NVS_I2C_SCAN, 16)
+
+        if bitmap is None:
+            with self.lock:
+                self.__check()
+                addresses = self.i2c.scan()
+            bitmap = bytearray(16)
+            for address in addresses:
+                bitmap[address >> 3] |= 1 << (address & 7)
+            NVS.set_bytes(NVS_I2C_SCAN, bitmap)
+            log.debug('I2C scan {}', addresses)
+
+        self.__addresses = [a for a in range(128) if bitmap[a >> 3] & (1 << (a & 7))]
+        return self.__addresses
+
+    def has(self, address):
+        """ True when a device with address is on the bus """
+        return address in self.scan()
+
+    def __check(self):
+        if not self.active:
+            raise OSError('I2C bus not initialized')
+
+    # machine.I2C interface
+
+    def init(self, *args, **kwargs):
+        """ Initialize the bus again after deinit and release the lock """
+        if not kwargs and not args:
+            kwargs = {'mode': I2C.MASTER, 'pins': self.pins}
+        try:
+            self.i2c.init(*args, **kwargs)
+            self.active = True
+        finally:
+            if self.__held:
+                self.__held = False
+                self.lock.release()
+
+    def deinit(self):
+        """
+        Release the bus pins (e.g. for the rtc calibration) until init,
+        the lock is held until then so other users wait for the bus
+        """
+        self.lock.acquire()
+        self.__held = True
+        self.active = False
+        self.i2c.deinit()
+
+    def readfrom(self, address, size):
+        with self.lock:
+            self.__check()
+            return self.i2c.readfrom(address, size)
+
+    def readfrom_into(self, address, buf):
+        with self.lock:
+            self.__check()
+            self.i2c.readfrom_into(address, buf)
+
+    def writeto(self, address, data):
+        with self.lock:
+            self.__check()
+            return self.i2c.writeto(address, data)
+
+    def readfrom_mem(self, address, register, size):
+        with self.lock:
+            self.__check()
+            return self.i2c.readfrom_mem(address, register, size)
+
+    def readfrom_mem_into(self, address, register, buf):
+        with self.lock:
+            self.__check()
+            self.i2c.readfrom_mem_into(address, register, buf)
+
+    def writeto_mem(self, address, register, data):
+        with self.lock:
+            self.__check()
+            return self.i2c.writeto_mem(address, register, data)
@@ -114,9 +114,20 @@ class LORAWAN(object):
         except Exception as e:
             log.error('Exception {} accesssing or joining LoRa network',e)
 
+    @property
+    def data_rate(self):
+        ' Return the data rate used for sending '
+        return self.__data_rate
+
+    @property
+    def has_joined(self):
+        ' Return if the device has joined the LoRa network '
+        return self.__lora.has_joined()
+
     def send_str(self, message=None):
-        'Send the message'
+        'Send the message, returns True when sent'
         
+        sent = False
         self.__socket = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
         self.__socket.setsockopt(socket.SOL_LORA, socket.SO_DR, self.__data_rate)
        
@@ -131,6 +142,7 @@ class LORAWAN(object):
                     log.debug('Send: ', message)
                     self.__socket.send(message)
                     self.__lora.nvram_save()
+                    sent = True
                     time.sleep(1)
 
             except OSError as e:
@@ -142,6 +154,8 @@ class LORAWAN(object):
             # (because if there's no data received it will block forever...)
             self.__socket.setblocking(False)
 
+        return sent
+
     def receive(self):
         'Receive a message'
 
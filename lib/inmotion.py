@@ -0,0 +1,257 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103,R0902
+
+"""
+InnovateNow motion analytics on LIS2HH12 FIFO batches.
+
+The accelerometer collects samples in its 32 sample FIFO (stream mode),
+the CPU sleeps and processes a full batch at once with integer math:
+    - activity: percentage of samples deviating more than a threshold from 1g
+    - shocks: number of events above the shock threshold and the peak g
+    - vibration: RMS of the deviation from the batch mean in mg
+    - tilt: angle between the batch orientation and the reference
+      orientation (kept in NVS), tamper when above the tilt threshold
+Samples are used with 12 bits resolution so squares stay small integers.
+"""
+
+import math
+import time
+import struct
+from array import array
+
+from innvs import NVS
+from LIS2HH12 import FIFO_SIZE, FIFO_MODE_STREAM
+
+# Initialize logging
+import inlogging as logging
+log = logging.getLogger(__name__)
+
+# NVS keys of the reference orientation
+NVS_MOTION_REF = ('mo_ref_x', 'mo_ref_y', 'mo_ref_z')
+
+# Raw sample to 12 bits
+SHIFT = 4
+
+
+class MotionAnalyzer(object):
+    """
+    Motion features of the accelerometer batches since the last reset
+    """
+
+    def __init__(self, scale_mg=8000, activity_mg=100, shock_mg=2000, tilt_degrees=30):
+        """
+        Initialize the analyzer
+        scale_mg: accelerometer full scale range in mg (LIS2HH12.SCALES)
+        """
+        self.scale_mg = scale_mg
+        self.tilt_degrees = tilt_degrees
+        self.buffer = array('h', [0] * (3 * FIFO_SIZE))
+
+        g = self.__units(1000)
+        activity = self.__units(activity_mg)
+        shock = self.__units(shock_mg)
+        self._active_lo2 = max(0, g - activity) ** 2
+        self._active_hi2 = (g + activity) ** 2
+        self._shock2 = shock * shock
+
+        self.reference = None
+        ref = [NVS.get_signed(key) for key in NVS_MOTION_REF]
+        if None not in ref:
+            self.reference = ref
+
+        self.reset()
+
+    def __units(self, mg):
+        """ mg to 12 bits sample units """
+        return mg * (65536 >> SHIFT) // self.scale_mg
+
+    def __mg(self, units):
+        """ 12 bits sample units to mg """
+        return units * self.scale_mg // (65536 >> SHIFT)
+
+    def reset(self):
+        """ Start a new reporting window """
+        self.samples = 0
+        self.active = 0
+        self.shocks = 0
+        self.tilts = 0
+        self._peak2 = 0
+        self._vibration = 0
+        self._in_shock = False
+        self._tilted = False
+        self._tilt = 0
+
+    def set_reference(self, orientation=None):
+        """ Store the (x, y, z) orientation as reference for tilt detection """
+        self.reference = list(orientation)
+        for key, value in zip(NVS_MOTION_REF, self.reference):
+            NVS.set(key, value)
+        log.debug('Motion reference orientation {}', self.reference)
+
+    def process(self, samples=None, count=0):
+        """ Process count x, y, z samples of a FIFO batch (array('h')) """
+        if not count:
+            return
+
+        lo2 = self._active_lo2
+        hi2 = self._active_hi2
+        shock2 = self._shock2
+        peak2 = self._peak2
+        in_shock = self._in_shock
+        active = 0
+        shocks = 0
+        sx = sy = sz = 0
+
+        end = 3 * count
+        for i in range(0, end, 3):
+            x = samples[i] >> SHIFT
+            y = samples[i + 1] >> SHIFT
+            z = samples[i + 2] >> SHIFT
+            sx += x
+            sy += y
+            sz += z
+
+            m2 = x * x + y * y + z * z
+            if m2 < lo2 or m2 > hi2:
+                active += 1
+            if m2 > peak2:
+                peak2 = m2
+            if m2 > shock2:
+                if not in_shock:
+                    shocks += 1
+                    in_shock = True
+            else:
+                in_shock = False
+
+        # Vibration around the batch mean
+        mx = sx // count
+        my = sy // count
+        mz = sz // count
+        vibration = 0
+        for i in range(0, end, 3):
+            dx = (samples[i] >> SHIFT) - mx
+            dy = (samples[i + 1] >> SHIFT) - my
+            dz = (samples[i + 2] >> SHIFT) - mz
+            vibration += dx * dx + dy * dy + dz * dz
+
+        self.samples += count
+        self.active += active
+        self.shocks += shocks
+        self._peak2 = peak2
+        self._in_shock = in_shock
+        self._vibration += vibration
+
+        # Orientation of a quiet batch
+        if active:
+            return
+
+        if self.reference is None:
+            self.set_reference((mx, my, mz))
+            return
+
+        self.__orientation(mx, my, mz)
+
+    def __orientation(self, x, y, z):
+        """ Update the tilt against the reference orientation """
+        rx, ry, rz = self.reference
+        norm = math.sqrt((x * x + y * y + z * z) * (rx * rx + ry * ry + rz * rz))
+        if not norm:
+            return
+
+        cos = max(-1.0, min(1.0, (x * rx + y * ry + z * rz) / norm))
+        self._tilt = int(math.degrees(math.acos(cos)))
+
+        tilted = self._tilt > self.tilt_degrees
+        if tilted and not self._tilted:
+            self.tilts += 1
+            log.info('Tilt of {} degrees detected', self._tilt)
+        self._tilted = tilted
+
+    def collect(self, acc=None, ms=0):
+        """
+        Collect and process FIFO batches for ms milliseconds, sleeping while
+        the accelerometer fills the FIFO
+        """
+        odr = acc.ODRS[acc.odr] or 1
+        batch_ms = (FIFO_SIZE - 4) * 1000 // odr # Read before the FIFO is full
+        start = time.ticks_ms()
+        while True:
+            remaining = ms - time.ticks_diff(time.ticks_ms(), start)
+            time.sleep_ms(max(0, min(remaining, batch_ms)))
+            self.process(self.buffer, acc.read_fifo(self.buffer))
+            if remaining <= batch_ms:
+                break
+
+    @staticmethod
+    def start(acc=None):
+        """ Start collecting samples in the accelerometer FIFO """
+        acc.enable_fifo(FIFO_MODE_STREAM)
+
+    @property
+    def activity(self):
+        """ Percentage of active samples """
+        return self.active * 100 // self.samples if self.samples else 0
+
+    @property
+    def peak(self):
+        """ Peak acceleration in mg """
+        return self.__mg(int(math.sqrt(self._peak2)))
+
+    @property
+    def vibration(self):
+        """ Vibration RMS in mg """
+        return self.__mg(int(math.sqrt(self._vibration // self.samples))) if self.samples else 0
+
+    @property
+    def tilt(self):
+        """ Last tilt against the reference orientation in degrees """
+        return self._tilt
+
+    @property
+    def tamper(self):
+        """ True when tilted more than the tilt threshold """
+        return self._tilted
+
+    def features(self):
+        """ Return the motion features as dict or None without samples """
+        if not self.samples:
+            return None
+
+        return {'activity': self.activity,
+                'peakG': round(self.peak / 1000, 2),
+                'shocks': self.shocks,
+                'vibrationRms': self.vibration,
+                'tilt': self.tilt,
+                'tilts': self.tilts,
+                'tamper': self.tamper}
+
+    def pack(self):
+        """
+        Transform to binary: activity % (uint8), peak mg (uint16), shocks
+        (uint8), vibration RMS mg (uint16), tilt degrees (uint8), tilts
+        (uint8), flags (uint8, bit 0 is tamper). Empty without samples
+        """
+        if not self.samples:
+            return b''
+
+        return struct.pack('>BHBHBBB', self.activity, min(self.peak, 65535), min(self.shocks, 255),
+                           min(self.vibration, 65535), self.tilt, min(self.tilts, 255),
+                           1 if self.tamper else 0)
@@ -23,8 +23,46 @@
 InnovateNow Message module
 """
 import json
+import struct
 import time
 
+def round_div(n, d):
+    """ Integer n / d rounded half to even, like round() of the float """
+    q, r = divmod(n, d)
+    if 2 * r > d or (2 * r == d and q & 1):
+        q += 1
+    return q
+
+def presence_dict(beacons=None, tags=None, beacons_left=None, tags_left=None, keyframe=True,
+                  sequence=None):
+    """
+    Return the beacon and tag presence (see inble.BeaconPresence) as a dict
+    When not a keyframe beacons and tags are the entered ids and
+    beacons_left and tags_left the hashes of the ids that left, relative
+    to the report with the previous sequence number
+    """
+    presence = dict()
+
+    if sequence is not None:
+        presence['seq'] = sequence
+
+    if beacons:
+        presence['beacons'] = beacons
+
+    if tags:
+        presence['tags'] = tags
+
+    if not keyframe:
+        presence['delta'] = True
+
+        if beacons_left:
+            presence['beaconsLeft'] = beacons_left
+
+        if tags_left:
+            presence['tagsLeft'] = tags_left
+
+    return presence
+
 class Message(object):
     """
     Class for constructing a message to send
@@ -107,13 +145,27 @@ class GPSMessage(Message):
 
         return lat + '|' + lon + '|{0:.0f}'.format(speed)
 
+    def pack(self):
+        """
+        Transform to binary GPS message: latitude and longitude in micro
+        degrees (int32), altitude m (int16), speed kph (uint8)
+        """
+        return struct.pack('>iihB',
+                           int((self.latitude or 0) * 1000000),
+                           int((self.longitude or 0) * 1000000),
+                           max(-32768, min(32767, int(self.altitude or 0))),
+                           min(255, int(self.speed or 0)))
+
 
 class EnvironMessage(Message):
     """
     Environmental messge
+    The values are floats or the integer compensated BME280 values
+    (temperature centi celsius, pressure Pa, humidity 1/1024 percentage),
+    which are packed without float conversion
     """
     def __init__(self, id=None, temperature=None, humidity=None,\
-                 barometric_pressure=None):
+                 barometric_pressure=None, compensated=None, stats=None):
 
         super(EnvironMessage, self).__init__()
 
@@ -121,46 +173,217 @@ class EnvironMessage(Message):
         self.temperature = temperature
         self.humidity = humidity
         self.barometric_pressure = barometric_pressure
+        self.compensated = tuple(compensated) if compensated else None
+        self.stats = stats if stats and stats.count else None # inenvstats.EnvironStats
+
+    def values(self):
+        """
+        Return (temperature celsius, humidity percentage, barometric pressure hPa)
+        """
+        if self.compensated:
+            t, p, h = self.compensated
+            return (t / 100, h / 1024, p / 100)
+
+        return (self.temperature, self.humidity, self.barometric_pressure)
 
     def to_dict(self):
         """
         Transform the message to a dict
         """
         self.message = super(EnvironMessage, self).to_dict()
+        temperature, humidity, barometric_pressure = self.values()
 
         if self.id:
             self.message['sensorId'] = self.id
 
-        if self.temperature:
-            self.message['temperature'] = round(self.temperature, 2)
+        if temperature:
+            self.message['temperature'] = round(temperature, 2)
 
-        if self.humidity:
-            self.message['humidity'] = round(self.humidity, 0)
+        if humidity:
+            self.message['humidity'] = round(humidity, 0)
 
-        if self.barometric_pressure:
-            self.message['barometricPressure'] = round(self.barometric_pressure, 0)
+        if barometric_pressure:
+            self.message['barometricPressure'] = round(barometric_pressure, 0)
+
+        if self.stats:
+            self.message['statistics'] = self.stats.summary()
 
         return self.message
 
     def lora(self):
         """ Transform to LoRa GPS message """
 
+        if self.compensated:
+            # Integer formatting of the compensated values, same text as the floats
+            t, p, h = self.compensated
+            temperature = '-80.00'
+            if t:
+                temperature = '{}{}.{:02d}'.format('-' if t < 0 else '', abs(t) // 100, abs(t) % 100)
+            return temperature + '|{}|{}'.format(round_div(h, 1024) if h else -1,
+                                                 round_div(p, 100) if p else -1)
+
         temperature = -80
         humidity = -1
         pressure = -1
+        values = self.values()
         
-        if self.temperature:
-            temperature = round(self.temperature, 2)
+        if values[0]:
+            temperature = round(values[0], 2)
 
-        if self.humidity:
-            humidity = round(self.humidity, 0)
+        if values[1]:
+            humidity = round(values[1], 0)
 
-        if self.barometric_pressure:    
-            pressure = round(self.barometric_pressure, 0)
+        if values[2]:    
+            pressure = round(values[2], 0)
 
         return '{0:.2f}'.format(temperature) + '|{0:.0f}'.format(humidity) + '|{0:.0f}'.format(pressure) 
+
+    def pack(self):
+        """
+        Transform to binary environmental message: temperature centi celsius
+        (int16, -32768 when unknown), pressure Pa (uint32), humidity 1/1024
+        percentage (uint32)
+        """
+        if self.compensated:
+            t, p, h = self.compensated
+        else:
+            t = int(round(self.temperature * 100)) if self.temperature is not None else -32768
+            p = int(round(self.barometric_pressure * 100)) if self.barometric_pressure else 0
+            h = int(round(self.humidity * 1024)) if self.humidity else 0
+
+        return struct.pack('>hII', t, p, h)
+
+    def pack_stats(self):
+        """
+        Transform the statistics window to binary: temperature min, max, mean
+        centi celsius (int16), stdev (uint16), seconds above and below the
+        thresholds (uint16). Empty without statistics
+        """
+        if not self.stats:
+            return b''
+
+        t_min, t_max, t_mean, t_stdev, above, below = self.stats.temperature()
+        return struct.pack('>hhhHHH', t_min, t_max, t_mean, min(t_stdev, 65535),
+                           min(above, 65535), min(below, 65535))
     
 
+class TrackerMessage(Message):
+    """
+    Tracker message with the GPS and environmental data of one wake cycle
+    """
+    def __init__(self, customer=None, device_id=None, gps_message=None,
+                 environ_message=None, battery=None, accelerometer=False,
+                 beacon_frame=None, beacons=None, binary=False, motion=None,
+                 battery_soc=None, presence=None):
+        """
+        Initialize Tracker message
+        beacon_frame and beacons (decoded records) are the BLE positioning
+        data used when there is no GPS fix
+        binary: send the binary instead of the text LoRa frame
+        motion: inmotion.MotionAnalyzer with the motion features of the window
+        battery_soc: battery state of charge percentage
+        presence: (sequence, keyframe, beacons, beacons left, tags, tags left) from
+        inble.BeaconPresence.update(), only in the json message
+        """
+        super(TrackerMessage, self).__init__()
+
+        self.customer = customer
+        self.device_id = device_id
+        self.gps_message = gps_message
+        self.environ_message = environ_message
+        self.battery = battery
+        self.battery_soc = battery_soc
+        self.accelerometer = accelerometer
+        self.beacon_frame = beacon_frame
+        self.beacons = beacons
+        self.binary = binary
+        self.motion = motion.features() if motion else None
+        self.motion_frame = motion.pack() if motion else b''
+        self.presence = presence
+        self.time = time.time()
+        self.__lora = None
+
+    def to_dict(self):
+        """
+        Transform the message to a dict
+        """
+        self.message = super(TrackerMessage, self).to_dict()
+
+        self.message['customer'] = self.customer
+        self.message['devId'] = self.device_id
+        self.message['time'] = self.time
+
+        self.message['sensors'] = list()
+
+        if self.environ_message:
+            self.message['sensors'].append(self.environ_message.to_dict())
+
+        if self.gps_message:
+            self.message['sensors'].append(self.gps_message.to_dict())
+
+        if self.battery:
+            self.message['battery'] = round(self.battery, 1)
+
+        if self.battery_soc is not None:
+            self.message['batterySoc'] = self.battery_soc
+
+        if self.accelerometer:
+            self.message['accelerometer'] = True
+
+        if self.beacons:
+            self.message['beacons'] = self.beacons
+
+        if self.motion:
+            self.message['motion'] = self.motion
+
+        if self.presence:
+            sequence, keyframe, beacons, beacons_left, tags, tags_left = self.presence
+            self.message['presence'] = presence_dict(beacons, tags, beacons_left,
+                                                     tags_left, keyframe, sequence)
+
+        return self.message
+
+    def lora(self):
+        """
+        Transform to LoRa tracker message
+        Without GPS fix but with beacons the BLE positioning frame is used:
+        'B', the beacon frame (count + records) and the environmental part
+        Binary frames are 'T' + GPS or 'B' + beacon frame, followed by the
+        environmental part, battery mV (uint16), flags (uint8, bit 0 is
+        awake from accelerometer, bit 1 is statistics present, bit 2 is
+        motion present), the environmental statistics and the motion features
+        The frame is built once and reused (debug log, router transports)
+        """
+        if self.__lora is None:
+            self.__lora = self.__frame()
+        return self.__lora
+
+    def __frame(self):
+        """ Build the LoRa tracker message """
+        if self.binary:
+            stats = self.environ_message.pack_stats()
+            flags = (1 if self.accelerometer else 0) | (2 if stats else 0) | \
+                    (4 if self.motion_frame else 0)
+            tail = self.environ_message.pack() + \
+                   struct.pack('>HB', int((self.battery or 0) * 1000), flags) + stats + \
+                   self.motion_frame
+
+            if self.beacon_frame and self.beacon_frame[0]:
+                return b'B' + self.beacon_frame + tail
+
+            return b'T' + self.gps_message.pack() + tail
+
+        msg = self.environ_message.lora() + '|{0:.1f}'.format(self.battery or 0)
+
+        if self.accelerometer:
+            msg += '|1' # Means awake from Accellerometer
+
+        if self.beacon_frame and self.beacon_frame[0]:
+            return b'B' + self.beacon_frame + msg.encode()
+
+        return self.gps_message.lora() + '|' + msg
+
+
 class AliveMessage(Message):
     """
     Alive message
@@ -193,9 +416,13 @@ class AWSMessage(Message):
     """
 
     def __init__(self, customer=None, device_id=None,\
-                 environ_message=None, gps_message=None, beacons=None, tags=None):
+                 environ_message=None, gps_message=None, beacons=None, tags=None,\
+                 beacons_left=None, tags_left=None, keyframe=True):
         """
         Initialize AWS message
+        When not a keyframe beacons and tags are the entered ids and
+        beacons_left and tags_left the hashes of the ids that left
+        (see inble.BeaconPresence)
         """
         super(AWSMessage, self).__init__()
 
@@ -205,6 +432,9 @@ class AWSMessage(Message):
         self.gps_message = gps_message
         self.beacons = beacons
         self.tags = tags
+        self.beacons_left = beacons_left
+        self.tags_left = tags_left
+        self.keyframe = keyframe
 
     def to_dict(self):
         """
@@ -224,10 +454,7 @@ class AWSMessage(Message):
         if self.gps_message:
             self.message['sensors'].append(self.gps_message)
 
-        if self.beacons:
-            self.message['beacons'] = self.beacons
-
-        if self.tags:
-            self.message['tags'] = self.tags
+        self.message.update(presence_dict(self.beacons, self.tags, self.beacons_left,
+                                          self.tags_left, self.keyframe))
 
         return self.message
@@ -25,26 +25,45 @@ InnovateNow Core Network Library
 
 import sys
 import time
+import binascii
 import machine
 
 from network import WLAN
+from innvs import NVS
 
 # Initialize logging
 import inlogging as logging
 log = logging.getLogger(__name__)
 
+# NVS keys for the cached WLAN connection
+NVS_WLAN_SSID = 'wl_ssid'
+NVS_WLAN_BSSID = 'wl_bssid'
+NVS_WLAN_CHANNEL = 'wl_chan'
+NVS_WLAN_SEC = 'wl_sec'
+NVS_WLAN_IFCONFIG = 'wl_ip'
+NVS_WLAN_LEASE = 'wl_lease'   # Time the DHCP lease was obtained
+
 class WLANNetwork(object):
     """
     Class manage the WLAN network
+    The accesspoint (BSSID, channel, security) and the DHCP lease of the last
+    successful connection are cached in NVS so a reconnect skips the scan
+    and DHCP. A scan is only done when the cached connection fails. The
+    DHCP lease is only reused up to lease_age seconds and dropped on the
+    first socket or MQTT failure (drop_lease).
     """
 
-    def __init__(self, ssid=None, key=None, antenna=WLAN.INT_ANT):
+    def __init__(self, ssid=None, key=None, antenna=WLAN.INT_ANT, timeout=10, reuse_ip=False,
+                 lease_age=3600):
         """
         Initialization of the WLAN network
         """
         self.ssid = ssid
         self.key = key
         self.antenna = antenna
+        self.timeout = timeout      # Connect timeout in seconds
+        self.reuse_ip = reuse_ip    # Reuse the cached DHCP lease as static ip config
+        self.lease_age = lease_age  # Max seconds to reuse the cached DHCP lease
         self.wlan = None
 
     @property
@@ -65,25 +84,117 @@ class WLANNetwork(object):
             # Init WLAN
             wlan = WLAN(mode=WLAN.STA, antenna=self.antenna)
 
-            # Scan for available accesspoints
-            nets = wlan.scan()
+            # Connect directly to the cached accesspoint
+            cache = self.__load_cache()
+            if cache:
+                bssid, channel, sec, ifconfig = cache
+                log.debug('Connect to cached accesspoint {} on channel {}',
+                          binascii.hexlify(bssid), channel)
 
-            for net in nets:
-                if net.ssid == self.ssid:
+                if self.__connect(wlan, sec, bssid, ifconfig):
+                    self.wlan = wlan
+                    if self.reuse_ip and not ifconfig:
+                        self.__save_lease()
+                else:
+                    log.warning('Cached accesspoint not available, scan for accesspoints')
+                    self.__erase_cache()
+                    if ifconfig:
+                        wlan.ifconfig(config='dhcp')
 
-                    # Connect to the network
-                    wlan.connect(self.ssid, (net.sec, self.key), timeout=10000)
-                    while not wlan.isconnected():
-                        machine.idle() # Save power while waiting
+            if self.wlan is None:
 
-                    self.wlan = wlan
-                    log.debug("ipconfig:" + str(self.wlan.ifconfig()))
-                    break
+                # Scan for available accesspoints
+                nets = wlan.scan()
+
+                for net in nets:
+                    if net.ssid == self.ssid:
+
+                        # Connect to the network
+                        if self.__connect(wlan, net.sec, net.bssid):
+                            self.wlan = wlan
+                            self.__save_cache(net.bssid, net.channel, net.sec)
+                        break
 
             if self.wlan is None:
                 log.error('Error establishing connection to wlan [' + self.ssid + ']')
                 raise IOError('Network connection to wlan [' + self.ssid + '] failed')
 
+            log.debug("ipconfig:" + str(self.wlan.ifconfig()))
+
+    def __connect(self, wlan, sec, bssid=None, ifconfig=None):
+        """
+        Connect and wait at most timeout seconds for the connection
+        """
+        if ifconfig:
+            wlan.ifconfig(config=ifconfig)
+
+        wlan.connect(self.ssid, auth=(sec, self.key), bssid=bssid, timeout=self.timeout * 1000)
+
+        start = time.ticks_ms()
+        while not wlan.isconnected():
+            if time.ticks_diff(time.ticks_ms(), start) > self.timeout * 1000:
+                wlan.disconnect()
+                return False
+            machine.idle() # Save power while waiting
+
+        return True
+
+    def __load_cache(self):
+        """
+        Return (bssid, channel, sec, ifconfig) of the cached accesspoint or None
+        """
+        if NVS.get(NVS_WLAN_SSID) != binascii.crc32(self.ssid.encode()):
+            return None
+
+        bssid = NVS.get_bytes(NVS_WLAN_BSSID, 6)
+        if bssid is None:
+            return None
+
+        ifconfig = None
+        age = time.time() - NVS.get(NVS_WLAN_LEASE, 0)
+        if self.reuse_ip and 0 <= age <= self.lease_age:
+            lease = NVS.get_bytes(NVS_WLAN_IFCONFIG, 16)
+            if lease and lease[0]:
+                ifconfig = tuple('.'.join(str(b) for b in lease[i:i + 4]) for i in range(0, 16, 4))
+
+        return (bssid, NVS.get(NVS_WLAN_CHANNEL, 0), NVS.get(NVS_WLAN_SEC, WLAN.WPA2), ifconfig)
+
+    def __save_cache(self, bssid, channel, sec):
+        """
+        Cache the accesspoint and DHCP lease of the current connection
+        """
+        NVS.set_bytes(NVS_WLAN_BSSID, bssid)
+        NVS.set(NVS_WLAN_CHANNEL, channel)
+        NVS.set(NVS_WLAN_SEC, sec)
+        NVS.set(NVS_WLAN_SSID, binascii.crc32(self.ssid.encode()))
+        if self.reuse_ip:
+            self.__save_lease()
+
+    def __save_lease(self):
+        """
+        Cache the DHCP lease of the current connection and the time obtained
+        """
+        lease = bytearray()
+        for addr in self.wlan.ifconfig():
+            lease.extend(bytes(int(b) for b in addr.split('.')))
+
+        NVS.set_bytes(NVS_WLAN_IFCONFIG, lease)
+        NVS.set(NVS_WLAN_LEASE, int(time.time()))
+
+    @staticmethod
+    def drop_lease():
+        """
+        Forget the cached DHCP lease, the next connect uses DHCP
+        """
+        NVS.erase(NVS_WLAN_LEASE)
+
+    @staticmethod
+    def __erase_cache():
+        """
+        Invalidate the cached accesspoint
+        """
+        NVS.erase(NVS_WLAN_SSID)
+
     def disconnect(self):
         """
         Disconnect the WLAN
@@ -114,11 +225,19 @@ class NTP(object):
         """
         self.ntp_pool_server = ntp_pool_server
 
-    def sync(self):
+    def sync(self, timeout=30):
         """
         Sync with network time
+        Wait at most timeout seconds, returns True when synced
         """
         rtc = machine.RTC()
         rtc.ntp_sync(self.ntp_pool_server, update_period=3600)
+
+        start = time.ticks_ms()
         while not rtc.synced():
-            time.sleep(1)
+            if time.ticks_diff(time.ticks_ms(), start) > timeout * 1000:
+                log.warning('NTP sync with [' + self.ntp_pool_server + '] timed out')
+                return False
+            time.sleep_ms(100)
+
+        return True
@@ -0,0 +1,93 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103,W0703
+
+"""
+InnovateNow non volatile storage (NVS) that survives deepsleep and reboots.
+
+Pycom NVS stores 32 bits unsigned integers with keys of max 15 characters.
+Byte strings are spread over several keys (key + index), each holding 4 bytes.
+"""
+
+import pycom
+
+class NVS(object):
+    """ Class for easy reading and writing the non volatile storage """
+
+    @staticmethod
+    def get(key=None, default=None):
+        """ Return the value of key or the default when not available """
+        try:
+            value = pycom.nvs_get(key)
+        except Exception: # Newer firmware raises when key not found
+            value = None
+
+        if value is None:
+            return default
+
+        return value
+
+    @staticmethod
+    def set(key=None, value=0):
+        """ Store the 32 bits unsigned value for key """
+        pycom.nvs_set(key, value & 0xFFFFFFFF)
+
+    @staticmethod
+    def erase(key=None):
+        """ Erase the key """
+        try:
+            pycom.nvs_erase(key)
+        except Exception: # Key not found
+            pass
+
+    @staticmethod
+    def get_bytes(key=None, length=0):
+        """ Return length bytes stored under key or None when not available """
+        data = bytearray(length)
+        for i in range(0, length, 4):
+            value = NVS.get(key + str(i // 4))
+            if value is None:
+                return None
+
+            for j in range(min(4, length - i)):
+                data[i + j] = (value >> (8 * j)) & 0xFF
+
+        return bytes(data)
+
+    @staticmethod
+    def set_bytes(key=None, data=b''):
+        """ Store the bytes under key """
+        for i in range(0, len(data), 4):
+            value = 0
+            for j, byte in enumerate(data[i:i + 4]):
+                value |= byte << (8 * j)
+            NVS.set(key + str(i // 4), value)
+
+    @staticmethod
+    def get_signed(key=None, default=None):
+        """ Return the value of key as 32 bits signed integer """
+        value = NVS.get(key)
+        if value is None:
+            return default
+
+        if value & 0x80000000:
+            value -= 0x100000000
+
+        return value
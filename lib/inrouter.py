@@ -0,0 +1,315 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103,W0703,R0913,R0902
+
+"""
+InnovateNow uplink router for sending messages over the cheapest transport.
+
+Every transport describes its capabilities and costs (max payload, energy
+per byte, fixed energy per uplink and latency) and keeps success statistics
+in NVS. The router sends each message over the transport with the lowest
+expected energy per delivered message. Transports that support batches
+(MQTT over WLAN) also drain the backlog of messages that could not be sent
+or were only sent as compact (lossy) LoRa frame. The success rate of a
+transport recovers slowly while unused, so a depot WLAN is tried again.
+"""
+
+import json
+
+from innvs import NVS
+from infiles import File
+
+# Initialize logging
+import inlogging as logging
+log = logging.getLogger(__name__)
+
+# Max LoRaWAN EU868 application payload per data rate (DR0 - DR6)
+LORA_MAX_PAYLOAD = (51, 51, 51, 115, 242, 242, 242)
+
+
+class Transport(object):
+    """
+    Base class for an uplink transport
+    Subclasses implement frame(message), the payload of the message for the
+    transport, and send(frame), returns True when sent
+    Energy is in micro joules, latency in milliseconds
+    """
+
+    # Transport can send the backlog in one session
+    batch = False
+
+    # Transport frame doesn't carry the complete message
+    lossy = False
+
+    def __init__(self, name=None, max_payload=0, energy_per_byte=0, energy_fixed=0, latency=0,
+                 min_success_rate=0.1):
+        self.name = name
+        self.max_payload = max_payload
+        self.energy_per_byte = energy_per_byte
+        self.energy_fixed = energy_fixed
+        self.latency = latency
+        self.min_success_rate = min_success_rate
+
+    @property
+    def sent(self):
+        """ Number of successful uplinks """
+        return NVS.get(self.name + '_ok', 0)
+
+    @property
+    def failed(self):
+        """ Number of failed uplinks """
+        return NVS.get(self.name + '_err', 0)
+
+    @property
+    def success_rate(self):
+        """ Recent success rate (0.0 - 1.0), an unused transport is assumed successful """
+        return max(self.min_success_rate, NVS.get(self.name + '_rate', 1000) / 1000)
+
+    def register(self, success):
+        """ Update the success statistics """
+        rate = NVS.get(self.name + '_rate', 1000)
+        if success:
+            NVS.set(self.name + '_ok', self.sent + 1)
+            rate += (1000 - rate) // 4
+        else:
+            NVS.set(self.name + '_err', self.failed + 1)
+            rate -= rate // 4
+        NVS.set(self.name + '_rate', rate)
+
+    def recover(self):
+        """ Slowly restore the success rate of an unused transport so it is tried again """
+        rate = NVS.get(self.name + '_rate', 1000)
+        if rate < 1000:
+            NVS.set(self.name + '_rate', rate + (1000 - rate) // 16 + 1)
+
+    def cost(self, size=0):
+        """ Expected energy to send size bytes, corrected with the success rate """
+        return (self.energy_fixed + self.energy_per_byte * size) / self.success_rate
+
+    def available(self):
+        """ Return if the transport can be used (cheap check, no connection) """
+        return True
+
+    def open(self):
+        """ Open the transport, returns True when it can send """
+        return True
+
+    def close(self):
+        """ Close the transport """
+        pass
+
+
+class LoRaTransport(Transport):
+    """
+    LoRaWAN transport sending the compact (lora) message frame
+    """
+
+    lossy = True
+
+    def __init__(self, lora=None, energy_per_byte=600, energy_fixed=100000, latency=2000):
+        super(LoRaTransport, self).__init__('lora', LORA_MAX_PAYLOAD[lora.data_rate],
+                                            energy_per_byte, energy_fixed, latency)
+        self.lora = lora
+
+    def frame(self, message):
+        return message.lora()
+
+    def available(self):
+        return self.lora.has_joined
+
+    def send(self, frame):
+        return self.lora.send_str(message=frame)
+
+
+class MQTTTransport(Transport):
+    """
+    AWS IoT MQTT over WLAN transport sending the json message
+    """
+
+    batch = True
+
+    def __init__(self, wlan=None, aws=None, max_payload=131072,
+                 energy_per_byte=2, energy_fixed=1500000, latency=5000):
+        super(MQTTTransport, self).__init__('wlan', max_payload,
+                                            energy_per_byte, energy_fixed, latency)
+        self.wlan = wlan
+        self.aws = aws
+
+    def frame(self, message):
+        return message.to_dict()
+
+    def open(self):
+        try:
+            self.wlan.connect()
+            if not self.aws.is_connected:
+                self.aws.connect()
+            return True
+        except Exception as e:
+            log.warning('WLAN/MQTT not available {}', e)
+            self.wlan.drop_lease() # A stale lease can be the cause
+            return False
+
+    def send(self, frame):
+        try:
+            if self.aws.publish(frame):
+                return True
+        except Exception as e:
+            log.error('MQTT publish failed {}', e)
+        self.wlan.drop_lease() # A stale lease can be the cause
+        return False
+
+    def close(self):
+        try:
+            self.aws.disconnect()
+        except Exception as e:
+            log.error('MQTT disconnect failed {}', e)
+        self.wlan.disconnect()
+
+
+class Backlog(object):
+    """
+    Messages (json frames) that could not be sent, stored on flash
+    """
+
+    def __init__(self, file='/flash/backlog.json', max_items=100):
+        self.file = file
+        self.max_items = max_items
+
+    def items(self):
+        """ Return the stored frames, oldest first """
+        if not File.exists(self.file):
+            return []
+
+        return [json.loads(line) for line in File.read(self.file).split('\n') if line]
+
+    def push(self, frame):
+        """ Store the frame, the oldest frames are dropped when full """
+        items = self.items()
+        if len(items) < self.max_items:
+            File.append(self.file, json.dumps(frame) + '\n')
+            return
+
+        items = items[len(items) - self.max_items + 1:]
+        items.append(frame)
+        self.store(items)
+
+    def store(self, items):
+        """ Replace the backlog with items """
+        if items:
+            File.write(self.file, '\n'.join(json.dumps(i) for i in items) + '\n')
+        else:
+            self.clear()
+
+    def clear(self):
+        """ Remove all frames """
+        if File.exists(self.file):
+            File.delete(self.file)
+
+
+class Router(object):
+    """
+    Send messages over the cheapest available transport
+    """
+
+    def __init__(self, transports=None, backlog=None):
+        self.transports = transports or []
+        self.backlog = backlog or Backlog()
+
+    @property
+    def batch(self):
+        """ True when a batch transport can drain the backlog """
+        return any(t.batch for t in self.transports)
+
+    def transport(self, name):
+        """ Return the transport with name or None """
+        for t in self.transports:
+            if t.name == name:
+                return t
+        return None
+
+    def __candidates(self, message, backlog):
+        """ Transports that can send the message, cheapest per delivered message first """
+        candidates = []
+        for t in self.transports:
+            frame = t.frame(message)
+            size = len(frame) if isinstance(frame, (str, bytes)) else len(json.dumps(frame))
+            if size > t.max_payload or not t.available():
+                continue
+
+            count = 1
+            if t.batch:
+                count += len(backlog)
+                size += sum(len(json.dumps(b)) for b in backlog)
+
+            candidates.append((t.cost(size) / count, t, frame))
+
+        candidates.sort(key=lambda c: c[0])
+        return candidates
+
+    def send(self, message):
+        """
+        Send the message (and the backlog when possible)
+        The backlog is only kept when a batch transport can drain it
+        Returns the name of the transport used or None when not sent
+        """
+        batch = self.batch
+        backlog = self.backlog.items() if batch else []
+        used = None
+
+        for cost, t, frame in self.__candidates(message, backlog):
+            log.debug('Try transport {} (cost {:.0f}uJ/msg)', t.name, cost)
+            if not t.open():
+                t.register(False)
+                continue
+
+            if t.batch:
+                # Drain the backlog, keep what could not be sent
+                while backlog and t.send(backlog[0]):
+                    backlog.pop(0)
+                self.backlog.store(backlog)
+                if backlog:
+                    t.register(False)
+                    continue
+
+            sent = t.send(frame)
+            t.register(sent)
+            if sent:
+                log.info('Message sent via {}', t.name)
+                used = t
+                break
+
+        for t in self.transports:
+            if t is not used:
+                t.recover()
+
+        # Keep the complete message for a batch transport
+        if batch and (used is None or used.lossy):
+            if used is None:
+                log.warning('No transport available, message stored in backlog')
+            self.backlog.push(message.to_dict())
+        elif used is None:
+            log.warning('No transport available, message dropped')
+
+        return used.name if used else None
+
+    def close(self):
+        """ Close all transports """
+        for t in self.transports:
+            t.close()
@@ -0,0 +1,162 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103,R0913,R0902
+
+"""
+InnovateNow motion adaptive deepsleep scheduler.
+
+A moving asset (GPS speed or accelerometer activity) reports every moving
+interval and is woken early by the accelerometer inactivity interrupt when
+it stops. A stationary asset doubles its sleep every wake up to the
+heartbeat interval and is woken by the accelerometer activity interrupt as
+soon as it moves. Without speed and activity an accelerometer wake flips the
+persisted motion state. The battery budget (mAh per day) is a bucket that
+refills with the time actually slept and is drained by every wake; when
+empty the wakes are limited to the rate the budget allows.
+"""
+
+from innvs import NVS
+from pycoproc import WAKE_REASON_ACCELEROMETER
+
+# Initialize logging
+import inlogging as logging
+log = logging.getLogger(__name__)
+
+# NVS keys
+NVS_SCHEDULE_STILL = 'sch_still'   # Number of stationary wakes in a row
+NVS_SCHEDULE_BUCKET = 'sch_bucket' # Battery budget left in uAh
+NVS_SCHEDULE_SLEEP = 'sch_sleep'   # Last scheduled sleep in seconds
+NVS_SCHEDULE_MOVING = 'sch_moving' # Motion state of the last schedule (1 is moving)
+
+
+class Schedule(object):
+    """
+    Sleep duration and accelerometer wake up sources for the next deepsleep
+    """
+
+    def __init__(self, seconds=300, moving=False, wake_on_activity=True, wake_on_inactivity=False):
+        self.seconds = seconds
+        self.moving = moving
+        self.wake_on_activity = wake_on_activity
+        self.wake_on_inactivity = wake_on_inactivity
+
+
+class SleepScheduler(object):
+    """
+    Pick the next deepsleep duration from the motion state and battery budget
+    """
+
+    def __init__(self, interval=300, moving_interval=60, heartbeat=21600,
+                 moving_speed=5, moving_activity=20, budget_mah=None, wake_mah=0.3):
+        """
+        Initialize the scheduler
+        interval: sleep seconds of the first stationary wake
+        moving_interval: sleep seconds while moving
+        heartbeat: max sleep seconds while stationary
+        moving_speed: GPS speed in kph above which the asset moves
+        moving_activity: motion activity percentage above which the asset moves
+        budget_mah: battery budget in mAh per day or None
+        wake_mah: estimated charge of one wake cycle in mAh
+        """
+        self.interval = interval
+        self.moving_interval = moving_interval
+        self.heartbeat = heartbeat
+        self.moving_speed = moving_speed
+        self.moving_activity = moving_activity
+        self.budget_mah = budget_mah
+        self.wake_mah = wake_mah
+
+    def is_moving(self, wake_reason=None, speed=None, activity=None):
+        """
+        True when the asset moves, the GPS speed and motion activity are
+        used when known, otherwise the previous motion state, flipped by
+        an accelerometer wake (activity while stationary, inactivity while
+        moving)
+        """
+        if speed is not None and speed >= self.moving_speed:
+            return True
+
+        if activity is not None and activity >= self.moving_activity:
+            return True
+
+        if speed is None and activity is None:
+            moving = bool(NVS.get(NVS_SCHEDULE_MOVING, 0))
+            if wake_reason == WAKE_REASON_ACCELEROMETER:
+                return not moving
+            return moving
+
+        return False
+
+    @property
+    def min_interval(self):
+        """ Sleep in seconds that spends exactly the battery budget """
+        if not self.budget_mah:
+            return 0
+
+        return int(86400 * self.wake_mah / self.budget_mah)
+
+    def budget(self, slept=None):
+        """
+        Refill the budget bucket with the last sleep, drain this wake and
+        return True when budget is left
+        slept: seconds actually slept or None for the last scheduled sleep
+        """
+        if not self.budget_mah:
+            return True
+
+        capacity = int(self.budget_mah * 1000)
+        bucket = NVS.get(NVS_SCHEDULE_BUCKET, capacity)
+        if slept is None:
+            slept = NVS.get(NVS_SCHEDULE_SLEEP, 0)
+        bucket += slept * capacity // 86400
+        bucket = min(capacity, bucket) - int(self.wake_mah * 1000)
+        NVS.set(NVS_SCHEDULE_BUCKET, max(0, bucket))
+
+        return bucket > 0
+
+    def next(self, wake_reason=None, speed=None, activity=None, slept=None):
+        """
+        Return the Schedule of the next deepsleep
+        speed: GPS speed in kph or None without fix
+        activity: motion activity percentage or None
+        slept: seconds actually slept or None for the last scheduled sleep
+        """
+        moving = self.is_moving(wake_reason, speed, activity)
+        NVS.set(NVS_SCHEDULE_MOVING, 1 if moving else 0)
+
+        if moving:
+            NVS.set(NVS_SCHEDULE_STILL, 0)
+            seconds = self.moving_interval
+        else:
+            still = NVS.get(NVS_SCHEDULE_STILL, 0)
+            seconds = min(self.heartbeat, self.interval << min(still, 16))
+            NVS.set(NVS_SCHEDULE_STILL, still + 1)
+
+        if not self.budget(slept):
+            seconds = max(seconds, self.min_interval)
+            log.warning('Battery budget spent, wakes limited')
+        NVS.set(NVS_SCHEDULE_SLEEP, seconds)
+
+        log.info('{}, next wake in {}s', 'Moving' if moving else 'Stationary', seconds)
+
+        # Moving: the timer reports, only wake early when the asset stops
+        # Stationary: wake as soon as the asset moves
+        return Schedule(seconds=seconds, moving=moving,
+                        wake_on_activity=not moving, wake_on_inactivity=moving)
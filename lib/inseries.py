@@ -0,0 +1,226 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103
+
+"""
+InnovateNow compact environmental time series on flash.
+
+Temperature samples are stored Gorilla-style in fixed size blocks: the
+block header holds the first sample, every next sample is the zig-zag
+varint of the timestamp delta-of-delta and of the value delta. With a
+regular interval and slow changes a sample takes 2 bytes. The blocks form
+a ring in one file (oldest block overwritten when full), the ring pointers
+are kept in NVS. Closed blocks are drained in chunks over a transport.
+"""
+
+import struct
+import time
+
+from innvs import NVS
+from infiles import File
+
+# Initialize logging
+import inlogging as logging
+log = logging.getLogger(__name__)
+
+# Block header: first time, last time, last time delta, first value, last value, count, used bytes
+HEADER = '>IIihhHH'
+HEADER_SIZE = struct.calcsize(HEADER)
+
+# NVS keys, block counters (slot is counter % blocks)
+NVS_SERIES_HEAD = 'ts_head'   # Oldest block not yet drained
+NVS_SERIES_TAIL = 'ts_tail'   # Block being written
+
+
+def zigzag(n):
+    """ Map signed to unsigned: 0, -1, 1, -2 ... to 0, 1, 2, 3 ... """
+    return (n << 1) ^ (n >> 31)
+
+def unzigzag(n):
+    """ Inverse of zigzag """
+    return (n >> 1) ^ -(n & 1)
+
+def put_varint(buf, pos, n):
+    """ Write the unsigned varint n into buf at pos, returns the next pos """
+    while n > 0x7F:
+        buf[pos] = (n & 0x7F) | 0x80
+        n >>= 7
+        pos += 1
+    buf[pos] = n
+    return pos + 1
+
+def get_varint(buf, pos):
+    """ Read an unsigned varint from buf at pos, returns (n, next pos) """
+    n = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+def decode_block(block):
+    """ Return the (time, value) samples of an encoded block """
+    first_t, _, _, first_v, _, count, used = struct.unpack_from(HEADER, block)
+    if not count:
+        return []
+
+    samples = [(first_t, first_v)]
+    t, v, dt = first_t, first_v, 0
+    pos = HEADER_SIZE
+    end = HEADER_SIZE + used
+    while pos < end and len(samples) < count:
+        dod, pos = get_varint(block, pos)
+        delta, pos = get_varint(block, pos)
+        dt += unzigzag(dod)
+        t += dt
+        v += unzigzag(delta)
+        samples.append((t, v))
+
+    return samples
+
+
+class TimeSeries(object):
+    """
+    Ring buffered temperature time series (centi celsius) on flash
+    """
+
+    def __init__(self, file='/flash/series.bin', blocks=32, block_size=256, interval=60):
+        """
+        Initialize the time series
+        blocks, block_size: ring size, the default 8KB holds about 2.5 days of 1 minute samples
+        interval: minimal seconds between samples
+        """
+        self.file = file
+        self.blocks = blocks
+        self.block_size = block_size
+        self.interval = interval
+        self.head = NVS.get(NVS_SERIES_HEAD)
+        self.tail = NVS.get(NVS_SERIES_TAIL)
+        self.block = None
+
+        if self.head is None or self.tail is None or not File.exists(self.file) \
+           or self.tail - self.head >= self.blocks:
+            self.clear()
+
+    def __offset(self, counter):
+        return (counter % self.blocks) * self.block_size
+
+    def __load(self):
+        """ Read the block being written """
+        if self.block is None:
+            self.block = bytearray(File.read_at(self.file, self.__offset(self.tail), self.block_size))
+
+    def __next(self):
+        """ Close the block being written and start a new (empty on flash) one """
+        self.tail += 1
+        self.block = bytearray(self.block_size)
+        File.write_at(self.file, self.__offset(self.tail), self.block)
+        if self.tail - self.head >= self.blocks:
+            self.head = self.tail - self.blocks + 1
+            log.debug('Time series full, oldest block dropped')
+            NVS.set(NVS_SERIES_HEAD, self.head)
+        NVS.set(NVS_SERIES_TAIL, self.tail)
+
+    def __len__(self):
+        """ Number of blocks with samples """
+        return self.tail - self.head + (1 if self.pending else 0)
+
+    @property
+    def pending(self):
+        """ Number of samples in the block being written """
+        self.__load()
+        return struct.unpack_from(HEADER, self.block)[5]
+
+    def add(self, environ=None, now=None):
+        """
+        Add the temperature of the Environment, skipped within interval of the last sample
+        """
+        compensated = environ.compensated() if environ else None
+        if not compensated:
+            return False
+
+        return self.append(compensated[0], now)
+
+    def append(self, value, now=None):
+        """ Append one sample (centi celsius), returns True when stored """
+        now = time.time() if now is None else now
+        value = max(-32768, min(32767, value))
+        self.__load()
+        first_t, last_t, last_dt, first_v, last_v, count, used = struct.unpack_from(HEADER, self.block)
+
+        if count:
+            dt = now - last_t
+            if 0 <= dt < self.interval:
+                return False
+
+            # Time set backwards or block full (max 5 bytes each varint)
+            if dt < 0 or HEADER_SIZE + used + 10 > self.block_size:
+                self.__next()
+                count = 0
+
+        if not count:
+            struct.pack_into(HEADER, self.block, 0, now, now, 0, value, value, 1, 0)
+        else:
+            pos = put_varint(self.block, HEADER_SIZE + used, zigzag(dt - last_dt))
+            pos = put_varint(self.block, pos, zigzag(value - last_v))
+            struct.pack_into(HEADER, self.block, 0, first_t, now, dt, first_v, value,
+                             count + 1, pos - HEADER_SIZE)
+
+        File.write_at(self.file, self.__offset(self.tail), self.block)
+        return True
+
+    def drain(self, send=None, max_payload=242, flush=True):
+        """
+        Send the closed blocks (and the block being written when flush) in
+        chunks of max payload bytes: 'S', block sequence, chunk index, chunk
+        count and the data. send(chunk) returns True when sent.
+        Returns the number of blocks sent, unsent blocks are kept.
+        """
+        if flush and self.pending:
+            self.__next()
+
+        sent = 0
+        size = max_payload - 4
+        while self.head < self.tail:
+            block = File.read_at(self.file, self.__offset(self.head), self.block_size)
+            data = block[:HEADER_SIZE + struct.unpack_from(HEADER, block)[6]]
+            total = (len(data) + size - 1) // size
+            for i in range(total):
+                chunk = b'S' + bytes((self.head & 0xFF, i, total)) + data[i * size:(i + 1) * size]
+                if not send(chunk):
+                    log.warning('Time series drain stopped, {} blocks sent', sent)
+                    return sent
+
+            self.head += 1
+            NVS.set(NVS_SERIES_HEAD, self.head)
+            sent += 1
+
+        return sent
+
+    def clear(self):
+        """ Remove all samples """
+        File.write_bytes(self.file, bytes(self.blocks * self.block_size))
+        self.head = self.tail = 0
+        NVS.set(NVS_SERIES_HEAD, 0)
+        NVS.set(NVS_SERIES_TAIL, 0)
+        self.block = None
@@ -0,0 +1,157 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=E0401,E1101,C0103
+
+"""
+InnovateNow device clock disciplined by GPS time.
+
+The RTC is lost during deepsleep, so before sleeping the current time and
+the sleep duration are stored in NVS. After wake up the time is estimated
+from these values and corrected with the measured sleep drift. The first
+valid GPS RMC time sets the RTC and updates the drift. NTP is an optional,
+time bounded, fallback.
+"""
+
+import time
+import machine
+
+from innvs import NVS
+
+# Initialize logging
+import inlogging as logging
+log = logging.getLogger(__name__)
+
+# NVS keys
+NVS_CLOCK_EPOCH = 'clk_epoch'   # Time when going to deepsleep
+NVS_CLOCK_SLEEP = 'clk_sleep'   # Deepsleep duration in seconds
+NVS_CLOCK_DRIFT = 'clk_drift'   # Measured deepsleep drift in ppm (signed)
+
+# Minimal sleep duration in seconds to measure the drift
+MIN_DRIFT_SLEEP = 60
+
+# Time source
+SOURCE_NONE = 0
+SOURCE_ESTIMATE = 1
+SOURCE_GPS = 2
+SOURCE_NTP = 3
+
+class Clock(object):
+    """
+    Class for keeping the device time across deepsleep cycles
+    """
+
+    def __init__(self):
+        self.rtc = machine.RTC()
+        self.source = SOURCE_NONE
+        self.__slept = None # Seconds slept before the restored estimate
+
+    @property
+    def synced(self):
+        """ True when the time is set from GPS or NTP """
+        return self.source >= SOURCE_GPS
+
+    @property
+    def valid(self):
+        """ True when the time is set or estimated """
+        return self.source != SOURCE_NONE
+
+    @property
+    def slept(self):
+        """ Seconds actually slept in the last deepsleep, None when unknown """
+        return self.__slept
+
+    def restore(self, sleep_remaining=0):
+        """
+        Estimate the time after a deepsleep wake up
+        @param sleep_remaining: seconds of the deepsleep left when woken up early
+        """
+        epoch = NVS.get(NVS_CLOCK_EPOCH)
+        sleep = NVS.get(NVS_CLOCK_SLEEP)
+
+        # Only once, a reset without deepsleep would add the sleep again
+        NVS.erase(NVS_CLOCK_EPOCH)
+
+        if epoch is None or sleep is None:
+            log.debug('No stored time to restore')
+            return False
+
+        slept = max(0, sleep - sleep_remaining)
+        drift = NVS.get_signed(NVS_CLOCK_DRIFT, 0)
+        estimate = epoch + slept + (slept * drift) // 1000000 + time.ticks_ms() // 1000
+
+        self.__set(estimate)
+        self.__slept = slept
+        self.source = SOURCE_ESTIMATE
+        log.debug('Time restored to {} (slept {}s, drift {}ppm)', estimate, slept, drift)
+        return True
+
+    def sync_gps(self, gps=None):
+        """
+        Set the RTC from the last valid GPS RMC date and time, advanced with
+        the time elapsed since it was parsed
+        """
+        if gps is None:
+            return False
+
+        dt = gps.datetime
+        if dt is None:
+            return False
+
+        epoch = time.mktime(dt + (0, 0))
+        if gps.fix_ticks is not None:
+            epoch += time.ticks_diff(time.ticks_ms(), gps.fix_ticks) // 1000
+
+        # The estimate is already drift corrected, the error is the drift left
+        if self.source == SOURCE_ESTIMATE and self.__slept >= MIN_DRIFT_SLEEP:
+            error = epoch - time.time()
+            drift = NVS.get_signed(NVS_CLOCK_DRIFT, 0)
+            drift += ((error * 1000000) // self.__slept) // 4 # Smoothed
+            NVS.set(NVS_CLOCK_DRIFT, drift)
+            log.debug('Clock error {}s, drift {}ppm', error, drift)
+
+        self.__set(epoch)
+        self.source = SOURCE_GPS
+        log.info('Time synced with GPS')
+        return True
+
+    def sync_ntp(self, ntp=None, timeout=10):
+        """
+        Fallback sync with an innetwork.NTP (needs a WLAN connection)
+        """
+        if ntp and ntp.sync(timeout=timeout):
+            self.source = SOURCE_NTP
+            log.info('Time synced with NTP')
+            return True
+
+        return False
+
+    def save(self, sleep=0):
+        """
+        Store the current time and the deepsleep duration before sleeping
+        """
+        if not self.valid:
+            return
+
+        NVS.set(NVS_CLOCK_EPOCH, time.time())
+        NVS.set(NVS_CLOCK_SLEEP, sleep)
+
+    def __set(self, epoch):
+        """ Set the RTC to the epoch """
+        self.rtc.init(time.localtime(epoch)[0:6])
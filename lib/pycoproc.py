@@ -11,6 +11,19 @@ WAKE_REASON_PUSH_BUTTON = 2
 WAKE_REASON_TIMER = 4
 WAKE_REASON_INT_PIN = 8
 
+class _Batch:
+    """ context manager queueing the register writes of a Pycoproc """
+
+    def __init__(self, coproc):
+        self.coproc = coproc
+
+    def __enter__(self):
+        self.coproc.begin()
+        return self.coproc
+
+    def __exit__(self, *args):
+        self.coproc.flush()
+
 class Pycoproc:
     """ class for handling the interaction with PIC MCU """
 
@@ -71,6 +84,17 @@ class Pycoproc:
 
     EXP_RTC_PERIOD = const(7000)
 
+    # NVS keys of the persisted rtc calibration
+    NVS_RTC_CAL = 'rtc_cal'         # clk_cal_factor * 1000000
+    NVS_RTC_CAL_TIME = 'rtc_cal_t'  # time of the calibration
+    NVS_RTC_CAL_TEMP = 'rtc_cal_tmp' # temperature in centi celsius (signed)
+    RTC_CAL_MIN_TIME = 1577836800   # 2020-01-01, an earlier time.time() counts from boot
+
+    # registers changed by the PIC itself, never served from the shadow cache
+    VOLATILE = (PORTA_ADDR, PORTC_ADDR, INTCON_ADDR, ADCON0_ADDR, ADRESL_ADDR, ADRESH_ADDR,
+                PCON_ADDR, STATUS_ADDR, WAKE_REASON_ADDR, WAKE_REASON_ADDR + 1,
+                WAKE_REASON_ADDR + 2, WAKE_REASON_ADDR + 3)
+
     def __init__(self, i2c=None, sda='P22', scl='P21'):
         if i2c is not None:
             self.i2c = i2c
@@ -80,10 +104,15 @@ class Pycoproc:
         self.sda = sda
         self.scl = scl
         self.clk_cal_factor = 1
+        self.clk_cal_valid = False # calibrated or restored during this boot
+        self.rtc_cal_max_age = 86400 # seconds before the stored calibration is stale
+        self.rtc_cal_max_temp_delta = 5 # celsius shift that makes the stored calibration stale
         self.reg = bytearray(6)
         self.wake_int = False
         self.wake_int_pin = False
         self.wake_int_pin_rising_edge = True
+        self._shadow = {} # last written value of the non volatile registers
+        self._batch = None # queued [addr, command] while batching
 
         # Make sure we are inserted into the
         # correct board and can talk to the PIC
@@ -92,17 +121,18 @@ class Pycoproc:
         except Exception as e:
             raise Exception('Board not detected: {}'.format(e))
 
-        # init the ADC for the battery measurements
-        self.poke_memory(ANSELC_ADDR, 1 << 2)
-        self.poke_memory(ADCON0_ADDR, (0x06 << _ADCON0_CHS_POSN) | _ADCON0_ADON_MASK)
-        self.poke_memory(ADCON1_ADDR, (0x06 << _ADCON1_ADCS_POSN))
-        # enable the pull-up on RA3
-        self.poke_memory(WPUA_ADDR, (1 << 3))
-        # make RC5 an input
-        self.set_bits_in_memory(TRISC_ADDR, 1 << 5)
-        # set RC6 and RC7 as outputs and enable power to the sensors and the GPS
-        self.mask_bits_in_memory(TRISC_ADDR, ~(1 << 6))
-        self.mask_bits_in_memory(TRISC_ADDR, ~(1 << 7))
+        with self.batch():
+            # init the ADC for the battery measurements
+            self.poke_memory(ANSELC_ADDR, 1 << 2)
+            self.poke_memory(ADCON0_ADDR, (0x06 << _ADCON0_CHS_POSN) | _ADCON0_ADON_MASK)
+            self.poke_memory(ADCON1_ADDR, (0x06 << _ADCON1_ADCS_POSN))
+            # enable the pull-up on RA3
+            self.poke_memory(WPUA_ADDR, (1 << 3))
+            # make RC5 an input
+            self.set_bits_in_memory(TRISC_ADDR, 1 << 5)
+            # set RC6 and RC7 as outputs and enable power to the sensors and the GPS
+            self.mask_bits_in_memory(TRISC_ADDR, ~(1 << 6))
+            self.mask_bits_in_memory(TRISC_ADDR, ~(1 << 7))
 
         if self.read_fw_version() < 6:
             raise ValueError('Firmware out of date')
@@ -143,25 +173,76 @@ class Pycoproc:
         d = self._read(2)
         return (d[1] << 8) + d[0]
 
+    def batch(self):
+        """ with py.batch(): queue the register writes, merged and deduplicated until flush """
+        return _Batch(self)
+
+    def begin(self):
+        """ start queueing register writes until flush() """
+        if self._batch is None:
+            self._batch = []
+
+    def flush(self):
+        """ send the queued register writes, the PIC handles one command at a time """
+        batch = self._batch
+        self._batch = None
+        if batch:
+            for _, cmd in batch:
+                self._write(cmd)
+
+    def _queue(self, addr, cmd):
+        """ write the command now or queue it, merged with the last queued command on addr """
+        if self._batch is None:
+            self._write(cmd)
+            return
+
+        if self._batch and self._batch[-1][0] == addr:
+            last = self._batch[-1][1]
+            if cmd[0] == CMD_POKE:
+                self._batch[-1][1] = cmd
+                return
+            if cmd[0] == CMD_MAGIC and last[0] == CMD_MAGIC and not last[5] and not cmd[5]:
+                # (v & a1 | o1) & a2 | o2 == v & (a1 & a2) | (o1 & a2 | o2)
+                self._batch[-1][1] = bytes([CMD_MAGIC, cmd[1], cmd[2], last[3] & cmd[3],
+                                            (last[4] & cmd[3]) | cmd[4], 0])
+                return
+
+        self._batch.append([addr, cmd])
+
     def peek_memory(self, addr):
+        if addr in self._shadow:
+            return self._shadow[addr]
         self._write(bytes([CMD_PEEK, addr & 0xFF, (addr >> 8) & 0xFF]))
         return self._read(1)[0]
 
     def poke_memory(self, addr, value):
-        self._write(bytes([CMD_POKE, addr & 0xFF, (addr >> 8) & 0xFF, value & 0xFF]))
+        value &= 0xFF
+        if addr not in self.VOLATILE:
+            self._shadow[addr] = value
+        self._queue(addr, bytes([CMD_POKE, addr & 0xFF, (addr >> 8) & 0xFF, value]))
+
+    def _modify(self, addr, _and=0xFF, _or=0, _xor=0):
+        """ read-modify-write, without a read when the register is in the shadow cache """
+        if addr in self._shadow:
+            self.poke_memory(addr, ((self._shadow[addr] & _and) | _or) ^ _xor)
+        elif self._batch is not None:
+            self._queue(addr, bytes([CMD_MAGIC, addr & 0xFF, (addr >> 8) & 0xFF,
+                                     _and & 0xFF, _or & 0xFF, _xor & 0xFF]))
+        else:
+            self.magic_write_read(addr, _and, _or, _xor)
 
     def magic_write_read(self, addr, _and=0xFF, _or=0, _xor=0):
         self._write(bytes([CMD_MAGIC, addr & 0xFF, (addr >> 8) & 0xFF, _and & 0xFF, _or & 0xFF, _xor & 0xFF]))
         return self._read(1)[0]
 
     def toggle_bits_in_memory(self, addr, bits):
-        self.magic_write_read(addr, _xor=bits)
+        self._modify(addr, _xor=bits)
 
     def mask_bits_in_memory(self, addr, mask):
-        self.magic_write_read(addr, _and=mask)
+        self._modify(addr, _and=mask)
 
     def set_bits_in_memory(self, addr, bits):
-        self.magic_write_read(addr, _or=bits)
+        self._modify(addr, _or=bits)
 
     def get_wake_reason(self):
         """ returns the wakeup reason, a value out of constants WAKE_REASON_* """
@@ -174,53 +255,52 @@ class Pycoproc:
         c1 = self.peek_memory(WAKE_REASON_ADDR + 1)
         time_device_s = (c3 << 16) + (c2 << 8) + c1
         # this time is from PIC internal oscilator, so it needs to be adjusted with the calibration value
-        try:
-            self.calibrate_rtc()
-        except Exception:
-            pass
+        # the sleep was set up with the stored factor, use it as is (the clock isn't restored yet)
+        if not self.clk_cal_valid:
+            factor = self._nvs_get(self.NVS_RTC_CAL)
+            if factor:
+                self.clk_cal_factor = factor / 1000000
         time_s = int((time_device_s / self.clk_cal_factor) + 0.5) # 0.5 used for round
         return time_s
 
-    def setup_sleep(self, time_s):
-        try:
-            self.calibrate_rtc()
-        except Exception:
-            pass
+    def setup_sleep(self, time_s, temperature=None):
+        self.update_rtc_calibration(temperature)
         time_s = int((time_s * self.clk_cal_factor) + 0.5)  # round to the nearest integer
         if time_s >= 2**(8*3):
             time_s = 2**(8*3)-1
         self._write(bytes([CMD_SETUP_SLEEP, time_s & 0xFF, (time_s >> 8) & 0xFF, (time_s >> 16) & 0xFF]))
 
     def go_to_sleep(self, gps=True):
-        # enable or disable back-up power to the GPS receiver
-        if gps:
-            self.set_bits_in_memory(PORTC_ADDR, 1 << 7)
-        else:
-            self.mask_bits_in_memory(PORTC_ADDR, ~(1 << 7))
-        # disable the ADC
-        self.poke_memory(ADCON0_ADDR, 0)
-
-        if self.wake_int:
-            # Don't touch RA3, RA5 or RC1 so that interrupt wake-up works
-            self.poke_memory(ANSELA_ADDR, ~((1 << 3) | (1 << 5)))
-            self.poke_memory(ANSELC_ADDR, ~((1 << 6) | (1 << 7) | (1 << 1)))
-        else:
-            # disable power to the accelerometer, and don't touch RA3 so that button wake-up works
-            self.poke_memory(ANSELA_ADDR, ~(1 << 3))
-            self.poke_memory(ANSELC_ADDR, ~(1 << 7))
-
-        self.poke_memory(ANSELB_ADDR, 0xFF)
-
-        # check if INT pin (PIC RC1), should be used for wakeup
-        if self.wake_int_pin:
-            if self.wake_int_pin_rising_edge:
-                self.set_bits_in_memory(OPTION_REG_ADDR, 1 << 6) # rising edge of INT pin
+        with self.batch():
+            # enable or disable back-up power to the GPS receiver
+            if gps:
+                self.set_bits_in_memory(PORTC_ADDR, 1 << 7)
             else:
-                self.mask_bits_in_memory(OPTION_REG_ADDR, ~(1 << 6)) # falling edge of INT pin
-            self.mask_bits_in_memory(ANSELC_ADDR, ~(1 << 1)) # disable analog function for RC1 pin
-            self.set_bits_in_memory(TRISC_ADDR, 1 << 1) # make RC1 input pin
-            self.mask_bits_in_memory(INTCON_ADDR, ~(1 << 1)) # clear INTF
-            self.set_bits_in_memory(INTCON_ADDR, 1 << 4) # enable interrupt; set INTE)
+                self.mask_bits_in_memory(PORTC_ADDR, ~(1 << 7))
+            # disable the ADC
+            self.poke_memory(ADCON0_ADDR, 0)
+
+            if self.wake_int:
+                # Don't touch RA3, RA5 or RC1 so that interrupt wake-up works
+                self.poke_memory(ANSELA_ADDR, ~((1 << 3) | (1 << 5)))
+                self.poke_memory(ANSELC_ADDR, ~((1 << 6) | (1 << 7) | (1 << 1)))
+            else:
+                # disable power to the accelerometer, and don't touch RA3 so that button wake-up works
+                self.poke_memory(ANSELA_ADDR, ~(1 << 3))
+                self.poke_memory(ANSELC_ADDR, ~(1 << 7))
+
+            self.poke_memory(ANSELB_ADDR, 0xFF)
+
+            # check if INT pin (PIC RC1), should be used for wakeup
+            if self.wake_int_pin:
+                if self.wake_int_pin_rising_edge:
+                    self.set_bits_in_memory(OPTION_REG_ADDR, 1 << 6) # rising edge of INT pin
+                else:
+                    self.mask_bits_in_memory(OPTION_REG_ADDR, ~(1 << 6)) # falling edge of INT pin
+                self.mask_bits_in_memory(ANSELC_ADDR, ~(1 << 1)) # disable analog function for RC1 pin
+                self.set_bits_in_memory(TRISC_ADDR, 1 << 1) # make RC1 input pin
+                self.mask_bits_in_memory(INTCON_ADDR, ~(1 << 1)) # clear INTF
+                self.set_bits_in_memory(INTCON_ADDR, 1 << 4) # enable interrupt; set INTE)
 
         self._write(bytes([CMD_GO_SLEEP]), wait=False)
         # kill the run pin
@@ -233,9 +313,11 @@ class Pycoproc:
         # hence the need for the constant
         self._write(bytes([CMD_CALIBRATE]), wait=False)
         self.i2c.deinit()
-        Pin('P21', mode=Pin.IN)
-        pulses = pycom.pulses_get('P21', 100)
-        self.i2c.init(mode=I2C.MASTER, pins=(self.sda, self.scl))
+        try:
+            Pin('P21', mode=Pin.IN)
+            pulses = pycom.pulses_get('P21', 100)
+        finally:
+            self.i2c.init(mode=I2C.MASTER, pins=(self.sda, self.scl))
         idx = 0
         for i in range(len(pulses)):
             if pulses[i][1] > EXP_RTC_PERIOD:
@@ -249,19 +331,89 @@ class Pycoproc:
             self.clk_cal_factor = (EXP_RTC_PERIOD / period) * (1000 / 1024)
         if self.clk_cal_factor > 1.25 or self.clk_cal_factor < 0.75:
             self.clk_cal_factor = 1
+            return False
+        return period > 0
+
+    @staticmethod
+    def _nvs_erase(key):
+        try:
+            pycom.nvs_erase(key)
+        except Exception: # key not found
+            pass
+
+    @staticmethod
+    def _nvs_get(key):
+        try:
+            return pycom.nvs_get(key)
+        except Exception: # newer firmware raises when key not found
+            return None
+
+    def update_rtc_calibration(self, temperature=None):
+        """
+        use the calibration stored in NVS, calibrate (and store) only when it
+        is missing, older than rtc_cal_max_age or the temperature (celsius)
+        shifted more than rtc_cal_max_temp_delta
+        the age and temperature are only checked (and the time stored) when
+        the clock is set, before that a stored calibration is always used
+        """
+        if self.clk_cal_valid:
+            return
+
+        factor = self._nvs_get(self.NVS_RTC_CAL)
+        cal_time = self._nvs_get(self.NVS_RTC_CAL_TIME)
+        cal_temp = self._nvs_get(self.NVS_RTC_CAL_TEMP)
+        now = time.time()
+        clock_valid = now >= self.RTC_CAL_MIN_TIME
+
+        stale = factor is None
+        if not stale and clock_valid:
+            stale = cal_time is None or not 0 <= now - cal_time <= self.rtc_cal_max_age
+        if not stale and clock_valid and temperature is not None and cal_temp is not None:
+            if cal_temp & 0x80000000:
+                cal_temp -= 0x100000000
+            stale = abs(temperature - cal_temp / 100) > self.rtc_cal_max_temp_delta
+
+        if not stale:
+            self.clk_cal_factor = factor / 1000000
+            self.clk_cal_valid = clock_valid # check again once the clock is set
+            return
+
+        try:
+            calibrated = self.calibrate_rtc()
+        except Exception:
+            calibrated = False
+
+        if calibrated:
+            self.clk_cal_valid = True
+            pycom.nvs_set(self.NVS_RTC_CAL, int(self.clk_cal_factor * 1000000))
+            if clock_valid:
+                pycom.nvs_set(self.NVS_RTC_CAL_TIME, int(now))
+            else:
+                self._nvs_erase(self.NVS_RTC_CAL_TIME)
+            if temperature is not None:
+                pycom.nvs_set(self.NVS_RTC_CAL_TEMP, int(temperature * 100) & 0xFFFFFFFF)
+            else:
+                self._nvs_erase(self.NVS_RTC_CAL_TEMP)
 
     def button_pressed(self):
         button = self.peek_memory(PORTA_ADDR) & (1 << 3)
         return not button
 
-    def read_battery_voltage(self):
+    def read_battery_adc(self):
+        """ one 10 bits ADC conversion of the battery voltage """
         self.set_bits_in_memory(ADCON0_ADDR, _ADCON0_GO_nDONE_MASK)
         time.sleep_us(50)
         while self.peek_memory(ADCON0_ADDR) & _ADCON0_GO_nDONE_MASK:
             time.sleep_us(100)
-        adc_val = (self.peek_memory(ADRESH_ADDR) << 2) + (self.peek_memory(ADRESL_ADDR) >> 6)
+        return (self.peek_memory(ADRESH_ADDR) << 2) + (self.peek_memory(ADRESL_ADDR) >> 6)
+
+    @staticmethod
+    def battery_adc_to_voltage(adc_val):
         return (((adc_val * 3.3 * 280) / 1023) / 180) + 0.01    # add 10mV to compensate for the drop in the FET
 
+    def read_battery_voltage(self):
+        return self.battery_adc_to_voltage(self.read_battery_adc())
+
     def setup_int_wake_up(self, rising, falling):
         """ rising is for activity detection, falling for inactivity """
         wake_int = False
@@ -29,17 +29,28 @@ import pycom
 import gc
 import sys
 import time
+import binascii
 
-from network import LoRa
+from network import LoRa, WLAN
 from pytrack import Pytrack
-from pycoproc import WAKE_REASON_ACCELEROMETER
+from ini2c import I2CBus
+from pycoproc import WAKE_REASON_ACCELEROMETER, WAKE_REASON_TIMER, WAKE_REASON_INT_PIN
 
 from version import VERSION
-from inmsg import GPSMessage, EnvironMessage
+from inmsg import GPSMessage, EnvironMessage, TrackerMessage
 from ingps import GPS
 from inlora import LORAWAN
-from inenvsensor import Environment
+from inenvsensor import Environment, RawSamples
+from inenvstats import EnvironStats
+from inseries import TimeSeries
+from inmotion import MotionAnalyzer
+from inschedule import SleepScheduler, Schedule
+from inbattery import Battery
 from LIS2HH12 import LIS2HH12
+from intime import Clock
+from innetwork import NTP
+from inble import BLEScanner, BeaconPresence, FleetFilter, EVICT_RSSI
+from inrouter import Router, Backlog, LoRaTransport, MQTTTransport
 
 # Initialize logging
 import inlogging as logging
@@ -51,13 +62,17 @@ except ImportError:
 log = logging.getLogger(__name__)
 
 lora = None
+router = None
 
 def start_network():
-    """ Start network logic """
-    # TODO: SigFox, WLAN and BLE
-    
+    """
+    Start network logic
+    Every network is an inrouter.Transport, a new network is added to the router transports
+    """
     log.debug('Start networking ...')
-    global lora
+    global lora, router
+    transports = []
+
     if config.LORA_ENABLED:
         log.info('Start LoRa network')        
         if not lora:
@@ -72,6 +87,22 @@ def start_network():
 
             lora.start() # Start joining LoRa Network                   
 
+        transports.append(LoRaTransport(lora=lora))
+
+    if config.WLAN_ENABLED:
+        log.info('Start WLAN/MQTT transport')
+        from innetwork import WLANNetwork
+        from inaws import AWS
+
+        wlan = WLANNetwork(ssid=config.WLAN_SSID, key=config.WLAN_KEY,
+                           antenna=WLAN.INT_ANT if config.WLAN_INT_ANTENNA else WLAN.EXT_ANT,
+                           timeout=config.WLAN_TIMEOUT, reuse_ip=config.WLAN_REUSE_IP,
+                           lease_age=config.WLAN_LEASE_AGE)
+        transports.append(MQTTTransport(wlan=wlan, aws=AWS()))
+
+    router = Router(transports=transports,
+                    backlog=Backlog(file=config.BACKLOG_FILE, max_items=config.BACKLOG_MAX_ITEMS))
+
 # Stop default heartbeat
 pycom.heartbeat(False)
 
@@ -86,8 +117,24 @@ wdt = machine.WDT(timeout=300000)
 
 try:
     
-    # Init pytrack board
-    py = Pytrack()
+    # Init pytrack board on the shared I2C bus (cached device scan)
+    bus = I2CBus()
+    py = Pytrack(i2c=bus)
+    py.rtc_cal_max_age = config.RTC_CALIBRATION_MAX_AGE
+    py.rtc_cal_max_temp_delta = config.RTC_CALIBRATION_MAX_TEMP_DELTA
+
+    # Battery state of charge and the charge of this wake cycle
+    battery = Battery(py, capacity_mah=config.BATTERY_CAPACITY_MAH,
+                      awake_ma=config.BATTERY_AWAKE_MA, sleep_ua=config.BATTERY_SLEEP_UA,
+                      soc_low=config.BATTERY_SOC_LOW, soc_high=config.BATTERY_SOC_HIGH)
+
+    # Estimate the time after deepsleep until GPS time is available
+    clock = Clock()
+    wake_reason = py.get_wake_reason()
+    if wake_reason == WAKE_REASON_TIMER:
+        clock.restore()
+    elif wake_reason in (WAKE_REASON_ACCELEROMETER, WAKE_REASON_INT_PIN):
+        clock.restore(sleep_remaining=py.get_sleep_remaining())
 
     wdt.feed() # Feed
 
@@ -100,7 +147,65 @@ try:
     gps = GPS(i2c=py.i2c)
 
     # Init environmental sensor
-    environ = Environment(i2c=py.i2c)
+    environ = Environment(i2c=py.i2c, preset=config.ENVIRONMENT_SENSOR_PRESET)
+
+    # Scale down sampling, GPS time and uplinks with a low battery
+    battery.measure(temperature=environ.temperature if config.ENVIRONMENT_SENSOR_AVAILABLE else None)
+    sample_interval = battery.stretch(config.ENVIRONMENT_SAMPLE_INTERVAL)
+
+    # Statistics window of the environment over the reporting window
+    stats = None
+    if config.ENVIRONMENT_SENSOR_AVAILABLE and config.ENVIRONMENT_STATS_ENABLED:
+        stats = EnvironStats(file=config.ENVIRONMENT_STATS_FILE,
+                             high=config.ENVIRONMENT_TEMPERATURE_HIGH,
+                             low=config.ENVIRONMENT_TEMPERATURE_LOW,
+                             window=config.ENVIRONMENT_STATS_WINDOW,
+                             max_gap=2 * sample_interval)
+
+    # Temperature time series
+    series = None
+    if config.ENVIRONMENT_SENSOR_AVAILABLE and config.ENVIRONMENT_SERIES_ENABLED:
+        series = TimeSeries(file=config.ENVIRONMENT_SERIES_FILE,
+                            blocks=config.ENVIRONMENT_SERIES_BLOCKS,
+                            interval=config.ENVIRONMENT_SERIES_INTERVAL)
+
+    # Motion analytics on accelerometer FIFO batches while waiting
+    acc = None
+    motion = None
+    if config.MOTION_ANALYTICS_ENABLED:
+        acc = LIS2HH12(py)
+        acc.set_odr(config.MOTION_ODR)
+        motion = MotionAnalyzer(scale_mg=acc.SCALES[acc.full_scale],
+                                activity_mg=config.MOTION_ACTIVITY_MG,
+                                shock_mg=config.MOTION_SHOCK_MG,
+                                tilt_degrees=config.MOTION_TILT_DEGREES)
+        motion.start(acc)
+
+    def idle(ms):
+        """ Sleep, processing the accelerometer FIFO in the meantime """
+        if motion:
+            motion.collect(acc, ms)
+        else:
+            time.sleep_ms(ms)
+
+    # Raw samples for the statistics and time series, compensated at uplink time
+    raw = None
+    if (stats or series) and config.ENVIRONMENT_DEFERRED_COMPENSATION:
+        raw = RawSamples(file=config.ENVIRONMENT_RAW_FILE)
+
+    def wait(seconds):
+        """ Wait, sampling the environment in the meantime """
+        if raw:
+            raw.sample(environ, seconds, sample_interval, idle)
+            return
+
+        if stats:
+            stats.sample(environ, seconds, sample_interval, idle)
+        else:
+            idle(seconds * 1000)
+
+        if series:
+            series.add(environ)
 
     # Led off
     pycom.heartbeat(False)
@@ -109,12 +214,60 @@ try:
 
     # Read GPS coordinates
     # Retry counter is used to stop when there is no GPS signal available
-    time.sleep(15) # Give GPS time to find a fix
+    gps_start = time.ticks_ms()
+    wait(15) # Give GPS time to find a fix
     retry_counter = 0
-    while not gps.coords_valid and retry_counter < 5:
+    gps_retries = battery.scale(5, minimum=1)
+    while not gps.coords_valid and retry_counter < gps_retries:
         gps.update()
         retry_counter += 1
-        time.sleep(5)  # Give the GPS time to get a fix
+        wait(5)  # Give the GPS time to get a fix
+
+    # No GPS fix, scan for beacons for indoor positioning
+    # The scan never takes longer than the GPS attempt it replaces and
+    # is skipped without registered UUIDs, no beacon would be reported
+    beacon_frame = None
+    beacons = None
+    fleet = None
+    if config.BLE_FLEET_FILTER:
+        fleet = FleetFilter(config.BLE_FLEET_FILTER)
+
+    if not gps.coords_valid and config.BLE_POSITIONING_ENABLED and config.BLE_UUIDS:
+        wdt.feed() # Feed
+        budget = min(config.BLE_POSITIONING_SCAN_SECONDS,
+                     time.ticks_diff(time.ticks_ms(), gps_start) // 1000)
+        log.info('No GPS fix, scan {}s for beacons', budget)
+
+        scanner = BLEScanner(max_list_items=config.BLE_POSITIONING_MAX_BEACONS,
+                             evict=EVICT_RSSI, fleet=fleet)
+        scanner.register_uuids(config.BLE_UUIDS)
+        scanner.start(timeout=budget)
+        scanner.stop()
+
+        beacon_frame = scanner.beacon_frame()
+        beacons = scanner.beacon_records
+
+    # Beacons and tags that entered or left since the previous report,
+    # all devices found (no UUID whitelist or strongest selection)
+    presence = None
+    reported = None
+    if config.BLE_PRESENCE_ENABLED:
+        wdt.feed() # Feed
+        log.info('Scan {}s for beacon and tag presence', config.BLE_PRESENCE_SCAN_SECONDS)
+
+        scanner = BLEScanner(capacity=config.BLE_PRESENCE_CAPACITY, evict=EVICT_RSSI, fleet=fleet)
+        scanner.start(timeout=config.BLE_PRESENCE_SCAN_SECONDS)
+        scanner.stop()
+
+        presence = BeaconPresence(config.BLE_PRESENCE_FILE,
+                                  keyframe_interval=config.BLE_PRESENCE_KEYFRAME)
+        reported = presence.update(scanner.beacon_ids, scanner.tag_ids)
+
+    # Set the device time from GPS, NTP over WLAN as fallback
+    if not clock.sync_gps(gps) and config.NTP_FALLBACK_ENABLED:
+        mqtt = router.transport('wlan')
+        if mqtt and mqtt.open():
+            clock.sync_ntp(NTP(config.NTP_POOL_SERVER), timeout=config.NTP_SYNC_TIMEOUT)
 
     wdt.feed() # Feed
     
@@ -128,37 +281,94 @@ try:
 
     log.debug('Prepare Environmental messsage')
     env_msg = EnvironMessage()
+    if raw:
+        for sample_time, sample in raw.compensated():
+            if stats:
+                stats.add(sample, now=sample_time)
+            if series:
+                series.append(sample[0], now=sample_time)
+        raw.clear()
+
     if config.ENVIRONMENT_SENSOR_AVAILABLE:
-        if environ.temperature and environ.humidity and environ.barometric_pressure:
-            env_msg = EnvironMessage(temperature=environ.temperature,
-                                    humidity=environ.humidity,
-                                    barometric_pressure=environ.barometric_pressure)
+        # One integer measurement for the check and the message
+        compensated = environ.compensated()
+        if compensated and compensated[1] and compensated[2]:
+            if stats:
+                stats.add(compensated)
+            env_msg = EnvironMessage(compensated=compensated, stats=stats)
         else:
             log.error('Problem with environmental sensor')                            
 
     # Send message
     pycom.rgbled(config.LED_COLOR_OK)
 
-    msg = gps_msg.lora() + '|' + env_msg.lora() + '|{0:.1f}'.format(py.read_battery_voltage())
+    msg = TrackerMessage(customer=config.CUSTOMER,
+                         device_id=config.DEVICE_ID,
+                         gps_message=gps_msg,
+                         environ_message=env_msg,
+                         battery=battery.voltage,
+                         battery_soc=battery.soc,
+                         accelerometer=wake_reason == WAKE_REASON_ACCELEROMETER,
+                         beacon_frame=beacon_frame,
+                         beacons=beacons,
+                         binary=config.LORA_BINARY_FRAME,
+                         motion=motion,
+                         presence=reported)
     
-    # Awake from Accelerometer
-    if py.get_wake_reason() == WAKE_REASON_ACCELEROMETER:
-        msg += '|1' # Means awake from Accellerometer
-    
-    log.debug ('LoRa message to send {}', msg)
-    lora.send_str(message=msg)
+    log.debug ('Message to send {}', msg.lora())
+    used = router.send(msg)
+
+    # Keep the reported set once the message is sent or in the backlog, the
+    # sequence number tells the backend a delta of a lost (LoRa) report is missing
+    if presence and (used or router.batch):
+        presence.save()
+
+    # Drain the time series while WLAN/MQTT is connected
+    if series and used == 'wlan' and battery.budget >= 0.5:
+        mqtt = router.transport('wlan')
+        series.drain(lambda chunk: mqtt.send({'devId': config.DEVICE_ID,
+                                              'series': binascii.b2a_base64(chunk).strip().decode()}),
+                     max_payload=mqtt.max_payload)
+
+    router.close()
+
+    # Summary of the complete window is sent (or in the backlog), start a new window
+    if stats and stats.expired():
+        stats.reset()
     pycom.heartbeat(False)
 
+    # Next deepsleep duration and accelerometer wake up from the motion state
+    schedule = Schedule(seconds=config.DEEPSLEEP_IN_SECONDS,
+                        wake_on_activity=True, wake_on_inactivity=True)
+    if config.SCHEDULE_ENABLED:
+        scheduler = SleepScheduler(interval=config.DEEPSLEEP_IN_SECONDS,
+                                   moving_interval=config.SCHEDULE_MOVING_SECONDS,
+                                   heartbeat=config.SCHEDULE_HEARTBEAT_SECONDS,
+                                   moving_speed=config.SCHEDULE_MOVING_SPEED_KPH,
+                                   moving_activity=config.SCHEDULE_MOVING_ACTIVITY,
+                                   budget_mah=config.SCHEDULE_BUDGET_MAH_PER_DAY,
+                                   wake_mah=battery.wake_mah or config.SCHEDULE_WAKE_MAH)
+        schedule = scheduler.next(wake_reason,
+                                  speed=gps.speed() if gps.coords_valid else None,
+                                  activity=motion.activity if motion and motion.samples else None,
+                                  slept=clock.slept)
+
+    schedule.seconds = battery.stretch(schedule.seconds, maximum=max(schedule.seconds,
+                                                                     config.SCHEDULE_HEARTBEAT_SECONDS))
+
     # Awake on Accelerometer
     if config.DEEPSLEEP_AWAKE_ON_ACCELEROMETER:
         
         # Disable wakeup source from INT pin
         py.setup_int_pin_wake_up(False)
 
-        # Enable activity and also inactivity interrupts, using the default callback handler
-        py.setup_int_wake_up(True, True)
+        # Enable activity and/or inactivity interrupts, using the default callback handler
+        py.setup_int_wake_up(schedule.wake_on_activity, schedule.wake_on_inactivity)
 
-        acc = LIS2HH12()
+        if acc is None:
+            acc = LIS2HH12(py)
+        else:
+            acc.disable_fifo()
                 
         # enable the activity/inactivity interrupts
         # set the accelereation threshold to 2000mG (2G) and the min duration to 200ms
@@ -167,11 +377,16 @@ try:
 
     # Go to sleep
     if config.DEEPSLEEP_ENABLED:
-        log.info('Start sleeping for {} seconds', config.DEEPSLEEP_IN_SECONDS)
-        time.sleep(2) # So everything can finish
-
-        # Sleep
-        py.setup_sleep(config.DEEPSLEEP_IN_SECONDS)
+        log.info('Start sleeping for {} seconds', schedule.seconds)
+        wait(2) # So everything can finish
+
+        # Sleep, the statistics window continues after wake up
+        clock.save(schedule.seconds)
+        battery.spend(schedule.seconds)
+        if stats:
+            stats.save()
+        py.setup_sleep(schedule.seconds,
+                       temperature=environ.temperature if config.ENVIRONMENT_SENSOR_AVAILABLE else None)
         py.go_to_sleep()    
 
 except Exception as e:
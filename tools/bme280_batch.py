@@ -0,0 +1,186 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=C0103
+
+"""
+InnovateNow host tool to compensate raw BME280 samples in batch.
+
+Reads the raw samples file of inenvsensor.RawSamples ('BMR1', calibration
+data, records of time and 8 bytes burst) and compensates all samples at
+once with vectorized NumPy integer arithmetic. Writes CSV: time,
+temperature C, pressure hPa, humidity %.
+
+--check compares the results with bme280.compensate (lib) on random bursts,
+the seed makes the check reproducible.
+
+Usage:
+    python tools/bme280_batch.py envraw.bin [output.csv]
+    python tools/bme280_batch.py --check [--samples 100000] [--seed 1]
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+CALIBRATION_SIZE = 33
+RECORD = np.dtype([('time', '>u4'), ('burst', 'u1', 8)])
+
+
+def calibration(data):
+    """ Compensation coefficients, see bme280.calibration """
+    T1, T2, T3, P1, P2, P3, P4, P5, P6, P7, P8, P9, _, H1 = \
+        struct.unpack('<HhhHhhhhhhhhBB', data[:26])
+    H2, H3 = struct.unpack_from('<hB', data, 26)
+    H4 = (struct.unpack_from('<b', data, 29)[0] << 4) | (data[30] & 0xF)
+    H5 = (struct.unpack_from('<b', data, 31)[0] << 4) | (data[30] >> 4)
+    H6 = struct.unpack_from('<b', data, 32)[0]
+    return (T1, T2, T3, P1, P2, P3, P4, P5, P6, P7, P8, P9, H1, H2, H3, H4, H5, H6)
+
+
+def read(file):
+    """ Return the calibration coefficients and the records of the raw samples file """
+    with open(file, 'rb') as fh:
+        data = fh.read()
+
+    if data[:4] != b'BMR1':
+        raise ValueError('Not a raw samples file [{}]'.format(file))
+
+    offset = 4 + CALIBRATION_SIZE
+    count = (len(data) - offset) // RECORD.itemsize
+    records = np.frombuffer(data, dtype=RECORD, count=count, offset=offset)
+    return calibration(data[4:offset]), records
+
+
+def compensate(cal, burst):
+    """
+    Compensate the (n, 8) raw bursts, returns int64 arrays of temperature
+    (centi celsius), pressure (Q24.8 Pa) and humidity (1/1024 percentage)
+    """
+    T1, T2, T3, P1, P2, P3, P4, P5, P6, P7, P8, P9, H1, H2, H3, H4, H5, H6 = \
+        (np.int64(c) for c in cal)
+    b = burst.astype(np.int64)
+    raw_press = ((b[:, 0] << 16) | (b[:, 1] << 8) | b[:, 2]) >> 4
+    raw_temp = ((b[:, 3] << 16) | (b[:, 4] << 8) | b[:, 5]) >> 4
+    raw_hum = (b[:, 6] << 8) | b[:, 7]
+
+    # temperature
+    var1 = ((raw_temp >> 3) - (T1 << 1)) * (T2 >> 11)
+    var2 = (((((raw_temp >> 4) - T1) * ((raw_temp >> 4) - T1)) >> 12) * T3) >> 14
+    t_fine = var1 + var2
+    temp = (t_fine * 5 + 128) >> 8
+
+    # pressure
+    var1 = t_fine - 128000
+    var2 = var1 * var1 * P6
+    var2 = var2 + ((var1 * P5) << 17)
+    var2 = var2 + (P4 << 35)
+    var1 = (((var1 * var1 * P3) >> 8) + ((var1 * P2) << 12))
+    var1 = (((np.int64(1) << 47) + var1) * P1) >> 33
+    valid = var1 != 0
+    p = 1048576 - raw_press
+    p = (((p << 31) - var2) * 3125) // np.where(valid, var1, 1)
+    var1 = (P9 * (p >> 13) * (p >> 13)) >> 25
+    var2 = (P8 * p) >> 19
+    pressure = np.where(valid, ((p + var1 + var2) >> 8) + (P7 << 4), 0)
+
+    # humidity
+    h = t_fine - 76800
+    h = (((((raw_hum << 14) - (H4 << 20) - (H5 * h)) + 16384) >> 15) *
+         (((((((h * H6) >> 10) * (((h * H3) >> 11) + 32768)) >> 10) + 2097152) * H2 + 8192) >> 14))
+    h = h - (((((h >> 15) * (h >> 15)) >> 7) * H1) >> 4)
+    h = np.clip(h, 0, 419430400)
+
+    return temp, pressure, h >> 12
+
+
+def check(samples=100000, seed=1):
+    """
+    Compare compensate with bme280.compensate on random bursts and the
+    datasheet calibration with random offsets, returns the number of mismatches
+    """
+    sys.modules.setdefault('ustruct', struct) # bme280 is MicroPython
+    import bme280
+
+    rnd = random.Random(seed)
+    mismatches = 0
+    for _ in range(max(1, samples // 1000)):
+        data = struct.pack('<HhhHhhhhhhhhBBhB',
+                           27504 + rnd.randint(-500, 500), 26435, -1000,
+                           36477 + rnd.randint(-500, 500), -10685, 3024, 2855, 140, -7,
+                           15500, -14600, 6000, 0, 75, 362, 0)
+        data += bytes([313 >> 4, ((50 & 0xF) << 4) | (313 & 0xF), 50 >> 4, 30])
+        cal = calibration(data)
+        if cal != bme280.calibration(data):
+            raise AssertionError('Calibration differs from bme280.calibration')
+
+        burst = np.array([[rnd.randint(0, 255) for _ in range(8)] for _ in range(1000)],
+                         dtype=np.uint8)
+        expected = compensate(cal, burst)
+
+        raw = [0, 0, 0]
+        result = [0, 0, 0]
+        for i, readout in enumerate(burst.tolist()):
+            bme280.parse_burst(readout, raw)
+            bme280.compensate(cal, raw[0], raw[1], raw[2], result)
+            if tuple(result) != tuple(int(e[i]) for e in expected):
+                mismatches += 1
+
+    return mismatches
+
+
+def main():
+    """ Command line entry """
+    parser = argparse.ArgumentParser(description='Compensate raw BME280 samples in batch')
+    parser.add_argument('file', nargs='?', help='raw samples file')
+    parser.add_argument('output', nargs='?', help='CSV output file, default stdout')
+    parser.add_argument('--check', action='store_true',
+                        help='compare with bme280.compensate on random bursts')
+    parser.add_argument('--samples', type=int, default=100000, help='bursts to check')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the check')
+    args = parser.parse_args()
+
+    if args.check:
+        mismatches = check(args.samples, args.seed)
+        print('{} mismatches in {} bursts (seed {})'.format(
+            mismatches, max(1, args.samples // 1000) * 1000, args.seed))
+        sys.exit(1 if mismatches else 0)
+
+    if not args.file:
+        parser.error('the raw samples file is required')
+
+    cal, records = read(args.file)
+    temp, pressure, humidity = compensate(cal, records['burst'])
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    out.write('time,temperature,pressure,humidity\n')
+    for row in zip(records['time'], temp / 100, (pressure >> 8) / 100, humidity / 1024):
+        out.write('{},{:.2f},{:.2f},{:.2f}\n'.format(*row))
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=C0103
+
+"""
+InnovateNow host tool to build the fleet filter file for inble.FleetFilter.
+
+Reads a customer MAC list (one MAC per line, hex with or without ':' or '-')
+and writes a Bloom filter or a sorted MAC array. Upload the result to the
+device flash (e.g. /flash/fleet.bin).
+
+Usage:
+    python tools/fleet_filter.py macs.txt fleet.bin [--sorted] [--fp 0.01]
+"""
+
+import argparse
+import binascii
+import math
+import struct
+
+
+def read_macs(file):
+    """ Read the MAC list, returns a sorted list of unique 6 byte MACs """
+    macs = set()
+    with open(file) as fh:
+        for line in fh:
+            line = line.strip().replace(':', '').replace('-', '')
+            if line and not line.startswith('#'):
+                mac = binascii.unhexlify(line)
+                if len(mac) != 6:
+                    raise ValueError('Invalid MAC [{}]'.format(line))
+                macs.add(mac)
+    return sorted(macs)
+
+
+def bloom(macs, fp=0.01):
+    """ Build the Bloom filter file content (same hashing as inble.FleetFilter) """
+    n = max(1, len(macs))
+    m = max(8, int(math.ceil(-n * math.log(fp) / (math.log(2) ** 2))))
+    m = (m + 7) // 8 * 8
+    k = max(1, int(round(m / n * math.log(2))))
+
+    bits = bytearray(m // 8)
+    for mac in macs:
+        h1 = binascii.crc32(mac)
+        h2 = binascii.crc32(mac, h1) | 1
+        for i in range(k):
+            bit = (h1 + i * h2) % m
+            bits[bit >> 3] |= 1 << (bit & 7)
+
+    return b'BLM1' + struct.pack('<B3xI', k, m) + bytes(bits)
+
+
+def sorted_array(macs):
+    """ Build the sorted MAC array file content """
+    return b'MAC1' + struct.pack('<I', len(macs)) + b''.join(macs)
+
+
+def main():
+    """ Command line entry """
+    parser = argparse.ArgumentParser(description='Build the BLE fleet filter file')
+    parser.add_argument('macs', help='text file with one MAC per line')
+    parser.add_argument('output', help='fleet filter file to write')
+    parser.add_argument('--sorted', action='store_true',
+                        help='write a sorted MAC array (exact) instead of a Bloom filter')
+    parser.add_argument('--fp', type=float, default=0.01, help='Bloom false positive rate')
+    args = parser.parse_args()
+
+    macs = read_macs(args.macs)
+    data = sorted_array(macs) if args.sorted else bloom(macs, args.fp)
+
+    with open(args.output, 'wb') as fh:
+        fh.write(data)
+
+    print('{} MACs, {} bytes written to {}'.format(len(macs), len(data), args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,452 @@
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Linter
+# pylint: disable=C0103,W0703,R0902,R0913
+
+"""
+InnovateNow host side benchmark of the AWS IoT (inaws) path.
+
+Runs on CPython. Starts an in-process MQTT 3.1.1 broker and replaces the
+Pycom MQTTLib with a shim that implements the AWSIoTMQTTClient interface
+over plain TCP, including the offline publish queue. Broker latency and
+disconnects can be injected to measure queueing and retry behaviour.
+
+Usage:
+    python tools/mqtt_bench.py [--messages 10000] [--latency-ms 0]
+                               [--disconnect-every 0] [--compress]
+"""
+
+import argparse
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+# MQTT control packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def _encode_length(length):
+    """ MQTT remaining length varint """
+    data = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        data.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(data)
+
+
+def _encode_string(value):
+    """ MQTT length prefixed utf-8 string """
+    if isinstance(value, str):
+        value = value.encode('UTF-8')
+    return struct.pack('!H', len(value)) + value
+
+
+def _packet(packet_type, flags=0, body=b''):
+    """ Build a control packet """
+    return bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _read_exact(sock, size):
+    """ Read size bytes or raise ConnectionError """
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        data += chunk
+    return data
+
+
+def _read_packet(sock):
+    """ Read one control packet, returns (type, flags, body) """
+    header = _read_exact(sock, 1)[0]
+    length = 0
+    multiplier = 1
+    while True:
+        byte = _read_exact(sock, 1)[0]
+        length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            break
+    return header >> 4, header & 0x0F, _read_exact(sock, length) if length else b''
+
+
+class Broker(socketserver.ThreadingTCPServer):
+    """
+    Minimal in-process MQTT 3.1.1 broker (QoS 0/1 publish, no retained messages)
+    latency: seconds to wait before acknowledging a publish
+    disconnect_every: drop the connection after every n-th publish (before the ack)
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, disconnect_every=0):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), _BrokerHandler)
+        self.latency = latency
+        self.disconnect_every = disconnect_every
+        self.received = 0
+        self.payload_bytes = 0
+        self.disconnects = 0
+        self.topics = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        """ Port the broker listens on """
+        return self.server_address[1]
+
+    def start(self):
+        """ Serve in a background thread """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving """
+        self.shutdown()
+        self.server_close()
+
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    """ Handle one client connection """
+
+    def handle(self):
+        broker = self.server
+        sock = self.request
+        try:
+            while True:
+                packet_type, flags, body = _read_packet(sock)
+
+                if packet_type == CONNECT:
+                    sock.sendall(_packet(CONNACK, body=b'\x00\x00'))
+
+                elif packet_type == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic_len = struct.unpack_from('!H', body)[0]
+                    topic = body[2:2 + topic_len].decode('UTF-8')
+                    offset = 2 + topic_len
+                    packet_id = None
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+
+                    with broker.lock:
+                        broker.received += 1
+                        broker.payload_bytes += len(body) - offset
+                        broker.topics[topic] = broker.topics.get(topic, 0) + 1
+                        drop = broker.disconnect_every and \
+                            broker.received % broker.disconnect_every == 0
+                        if drop:
+                            broker.disconnects += 1
+
+                    if drop:
+                        return
+
+                    if broker.latency:
+                        time.sleep(broker.latency)
+
+                    if qos:
+                        sock.sendall(_packet(PUBACK, body=packet_id))
+
+                elif packet_type == SUBSCRIBE:
+                    granted = bytes([0] * max(1, (len(body) - 2) // 3))
+                    sock.sendall(_packet(SUBACK, body=body[:2] + granted[:1]))
+
+                elif packet_type == PINGREQ:
+                    sock.sendall(_packet(PINGRESP))
+
+                elif packet_type == DISCONNECT:
+                    return
+
+        except (ConnectionError, OSError):
+            return
+        finally:
+            sock.close()
+
+
+class AWSIoTMQTTClient(object):
+    """
+    Shim with the Pycom MQTTLib AWSIoTMQTTClient interface over plain TCP
+    Credentials are accepted but ignored (no TLS).
+    """
+
+    def __init__(self, clientID):
+        self.client_id = clientID
+        self.host = None
+        self.port = None
+        self.offline_queue_size = -1
+        self.draining_interval = 0.5
+        self.conn_timeout = 30
+        self.oper_timeout = 10
+        self._sock = None
+        self._packet_id = 0
+        self._queue = []
+        self.reconnects = 0
+        self.queued = 0
+        self.max_queue = 0
+        self.dropped = 0
+
+    def configureEndpoint(self, hostName, portNumber):
+        self.host = hostName
+        self.port = portNumber
+
+    def configureCredentials(self, CAFilePath, KeyPath='', CertificatePath=''):
+        pass
+
+    def configureLastWill(self, topic, payload, QoS):
+        pass
+
+    def configureOfflinePublishQueueing(self, queueSize, dropBehavior=0):
+        self.offline_queue_size = queueSize
+
+    def configureDrainingFrequency(self, frequencyInHz):
+        self.draining_interval = 1.0 / frequencyInHz if frequencyInHz else 0
+
+    def configureConnectDisconnectTimeout(self, timeoutSecond):
+        self.conn_timeout = timeoutSecond
+
+    def configureMQTTOperationTimeout(self, timeoutSecond):
+        self.oper_timeout = timeoutSecond
+
+    def connect(self, keepAliveInterval=30):
+        try:
+            self._sock = socket.create_connection((self.host, self.port), self.conn_timeout)
+            self._sock.settimeout(self.oper_timeout)
+            body = _encode_string('MQTT') + bytes([4, 0x02]) + \
+                struct.pack('!H', keepAliveInterval) + _encode_string(self.client_id)
+            self._sock.sendall(_packet(CONNECT, body=body))
+            packet_type, _, body = _read_packet(self._sock)
+            return packet_type == CONNACK and body[1] == 0
+        except (ConnectionError, OSError):
+            self._close()
+            return False
+
+    def publish(self, topic, payload, QoS):
+        if self._queue or not self._publish(topic, payload, QoS):
+            self._enqueue(topic, payload, QoS)
+            self._drain()
+        return True
+
+    def disconnect(self):
+        self._drain()
+        if self._sock:
+            try:
+                self._sock.sendall(_packet(DISCONNECT))
+            except OSError:
+                pass
+        self._close()
+        return True
+
+    def _publish(self, topic, payload, qos):
+        """ Publish one message, returns False when the connection is lost """
+        if self._sock is None:
+            return False
+
+        if isinstance(payload, str):
+            payload = payload.encode('UTF-8')
+
+        body = _encode_string(topic)
+        if qos:
+            self._packet_id = self._packet_id % 65535 + 1
+            body += struct.pack('!H', self._packet_id)
+
+        try:
+            self._sock.sendall(_packet(PUBLISH, flags=qos << 1, body=body + payload))
+            if qos:
+                packet_type, _, _ = _read_packet(self._sock)
+                return packet_type == PUBACK
+            return True
+        except (ConnectionError, OSError):
+            self._close()
+            return False
+
+    def _enqueue(self, topic, payload, qos):
+        """ Offline publish queue, drop the oldest message when full """
+        if self.offline_queue_size == 0:
+            self.dropped += 1
+            return
+
+        if 0 < self.offline_queue_size <= len(self._queue):
+            self._queue.pop(0)
+            self.dropped += 1
+
+        self._queue.append((topic, payload, qos))
+        self.queued += 1
+        self.max_queue = max(self.max_queue, len(self._queue))
+
+    def _drain(self):
+        """ Reconnect and send the offline queue at the draining frequency """
+        while self._queue:
+            if self._sock is None:
+                self.reconnects += 1
+                if not self.connect():
+                    return
+
+            if not self._publish(*self._queue[0]):
+                continue
+
+            self._queue.pop(0)
+            if self._queue and self.draining_interval:
+                time.sleep(self.draining_interval)
+
+    def _close(self):
+        if self._sock:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+
+
+def install(broker, compress=False):
+    """
+    Install the MQTTLib shim and an aws_config pointing to the broker so
+    inaws can be imported on the host
+    """
+    mqttlib = types.ModuleType('MQTTLib')
+    mqttlib.AWSIoTMQTTClient = AWSIoTMQTTClient
+    sys.modules['MQTTLib'] = mqttlib
+
+    aws_config = types.ModuleType('aws_config')
+    aws_config.AWS_IOT_HOST = '127.0.0.1'
+    aws_config.AWS_IOT_PORT = broker.port
+    aws_config.AWS_IOT_TOPIC = 'beaconscanner'
+    aws_config.AWS_IOT_COMPRESSION_ENABLED = compress
+    aws_config.AWS_IOT_COMPRESS_MIN_SIZE = 256
+    aws_config.AWS_IOT_CLIENT_CERT = ''
+    aws_config.AWS_IOT_PRIVATE_KEY = ''
+    aws_config.AWS_IOT_ROOT_CA = ''
+    aws_config.AWS_IOT_CLIENT_ID = 'bench'
+    aws_config.AWS_IOT_OFFLINE_QUEUE_SIZE = -1
+    aws_config.AWS_IOT_DRAINING_FREQ = 50
+    aws_config.AWS_IOT_CONN_DISCONN_TIMEOUT = 5
+    aws_config.AWS_IOT_MQTT_OPER_TIMEOUT = 5
+    sys.modules['aws_config'] = aws_config
+
+
+def _percentile(values, pct):
+    """ Percentile of sorted values """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(messages=10000, latency=0.0, disconnect_every=0, compress=False, beacons=10):
+    """ Run the benchmark and return the results as dict """
+    import inlogging as logging
+    logging.basicConfig(level=logging.WARNING, stream=sys.stdout)
+
+    broker = Broker(latency=latency, disconnect_every=disconnect_every).start()
+    install(broker, compress=compress)
+
+    from inaws import AWS
+    from inmsg import AWSMessage, EnvironMessage, GPSMessage
+
+    beacon_list = ['4c000215e2c56db5dffb48d2b060d0f5a71096e0{0:04x}{1:04x}c5'.format(0, i)
+                   for i in range(beacons)]
+
+    tracemalloc.start()
+    aws = AWS()
+    latencies = []
+
+    start = time.perf_counter()
+    aws.connect()
+    for i in range(messages):
+        msg = AWSMessage(customer='InnovateNow', device_id='bench',
+                         environ_message=EnvironMessage(temperature=4.5 + i % 10 / 10,
+                                                        humidity=80,
+                                                        barometric_pressure=1013).to_dict(),
+                         gps_message=GPSMessage(latitude=52.09, longitude=5.12).to_dict(),
+                         beacons=beacon_list)
+        t0 = time.perf_counter()
+        aws.publish(msg.to_dict())
+        latencies.append(time.perf_counter() - t0)
+    client = aws.client
+    aws.disconnect()
+    elapsed = time.perf_counter() - start
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Wait until the broker processed the last packets
+    time.sleep(0.1)
+    broker.stop()
+
+    latencies.sort()
+    return {
+        'messages': messages,
+        'elapsed_s': elapsed,
+        'msg_per_s': messages / elapsed,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'peak_memory_kb': peak / 1024,
+        'broker_received': broker.received,
+        'broker_payload_kb': broker.payload_bytes / 1024,
+        'broker_disconnects': broker.disconnects,
+        'client_reconnects': client.reconnects,
+        'client_queued': client.queued,
+        'client_max_queue': client.max_queue,
+        'client_dropped': client.dropped,
+    }
+
+
+def main():
+    """ Command line entry """
+    parser = argparse.ArgumentParser(description='Benchmark the inaws MQTT path')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--beacons', type=int, default=10, help='beacons per message')
+    parser.add_argument('--latency-ms', type=float, default=0, help='broker ack latency')
+    parser.add_argument('--disconnect-every', type=int, default=0,
+                        help='broker drops the connection every n publishes')
+    parser.add_argument('--compress', action='store_true', help='enable payload compression')
+    args = parser.parse_args()
+
+    results = run(messages=args.messages, latency=args.latency_ms / 1000,
+                  disconnect_every=args.disconnect_every, compress=args.compress,
+                  beacons=args.beacons)
+
+    for key, value in results.items():
+        if isinstance(value, float):
+            print('{:20s} {:.3f}'.format(key, value))
+        else:
+            print('{:20s} {}'.format(key, value))
+
+
+if __name__ == '__main__':
+    main()